@@ -0,0 +1,240 @@
+#in process stand-ins for discord and lavalink, enough for the music cog, PlayerContext and PlayerWindow to run offline
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+import pomice
+
+import lib.music.player
+
+_ids = itertools.count(1000)
+
+class FakeMessage():
+    def __init__(self, channel, embed=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.embed = embed
+        self.edits = 0
+
+    async def edit(self, embed=None, **kwargs):
+        self.embed = embed
+        self.edits += 1
+        self.channel.edited.append(time.perf_counter())
+
+    async def delete(self):
+        self.channel.deleted += 1
+
+class FakeTextChannel():
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.sent = 0
+        self.deleted = 0
+        self.edited = []
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self, embed)
+
+class FakeMenu():
+    #replaces reactionmenu's PlayerMenu, which needs a real gateway to attach its view
+    def __init__(self, bot, channel, embed, **kwargs):
+        self.bot = bot
+        self.channel = channel
+        self.embed = embed
+        self.message = None
+        self._ctx = None
+
+    async def start(self, send_to):
+        self.message = await send_to.send(embed=self.embed)
+
+    async def restart(self, timeout):
+        pass
+
+    async def stop(self):
+        pass
+
+    def enable_all_buttons(self):
+        pass
+
+    def disable_all_buttons(self):
+        pass
+
+class FakeNode():
+    #looks like a connected pomice node, tracks finish after length/speed real seconds
+    def __init__(self, identifier="FAKE", speed=600, resolve_delay=0.0):
+        self._identifier = identifier
+        self._players = {}
+        self.speed = speed
+        self.resolve_delay = resolve_delay
+        self.is_connected = True
+        self.on_track_end = None #async (player, track, reason), normally Music.on_pomice_track_end
+        self.missing = set() #queries that fail to load, like deleted videos in an old snapshot
+
+    @property
+    def players(self):
+        return self._players
+
+    @property
+    def stats(self):
+        playing = sum(1 for player in self._players.values() if player.current)
+        return SimpleNamespace(cpu_cores=1, cpu_system_load=0.0, cpu_process_load=0.0,
+            players_active=playing, players_total=len(self._players))
+
+    async def get_tracks(self, query, ctx=None):
+        if self.resolve_delay:
+            await asyncio.sleep(self.resolve_delay)
+        if query in self.missing:
+            raise pomice.TrackLoadError(f"No track found for {query}")
+        identifier = f"{abs(hash(query)) % 10**11:011}"
+        info = {
+            "identifier": identifier,
+            "isSeekable": True,
+            "author": "Fake Artist",
+            "length": 120000 + int(identifier[-5:]) % 120000,
+            "isStream": False,
+            "position": 0,
+            "title": f"Fake track for {query}",
+            "uri": f"https://www.youtube.com/watch?v={identifier}",
+            "sourceName": "youtube",
+            "thumbnail": f"https://i.ytimg.com/vi/{identifier}/mqdefault.jpg",
+        }
+        return [pomice.Track(track_id=f"fake:{identifier}", info=info, ctx=ctx)]
+
+class FakeLavaPlayer():
+    #the parts of pomice.Player that LavaPlayer and the music cog call
+    def __init__(self, node, guild, channel):
+        self.node = node
+        self._node = node
+        self.guild = guild
+        self.channel = channel
+        self.current = None
+        self.volume = 100
+        self.is_paused = False
+        self.is_connected = True
+        self.started = asyncio.Event() #set whenever a track starts, for measuring command to playback
+        self.plays = 0
+        self._started_at = None
+        self._end_task = None
+        node._players[guild.id] = self
+
+    @property
+    def position(self):
+        return (time.monotonic() - self._started_at)*1000*self.node.speed if self._started_at else 0
+
+    async def get_tracks(self, query, ctx=None):
+        return await self.node.get_tracks(query, ctx=ctx)
+
+    async def play(self, track, start=0):
+        self._cancel_end()
+        self.current = track
+        self.plays += 1
+        self._started_at = time.monotonic()
+        self._end_task = asyncio.get_running_loop().create_task(self._finish(track))
+        self.started.set()
+
+    async def _finish(self, track):
+        await asyncio.sleep(track.length/1000/self.node.speed)
+        self._end_task = None
+        await self._track_end(track)
+
+    async def _track_end(self, track):
+        self.current = None
+        if self.node.on_track_end:
+            await self.node.on_track_end(self, track, None)
+
+    def _cancel_end(self):
+        if self._end_task:
+            self._end_task.cancel()
+            self._end_task = None
+
+    async def stop(self):
+        #lavalink sends a track end event for stopped tracks too
+        self._cancel_end()
+        if track := self.current:
+            await self._track_end(track)
+
+    async def set_pause(self, pause):
+        self.is_paused = pause
+
+    async def seek(self, position):
+        pass
+
+    async def set_volume(self, volume):
+        self.volume = volume
+
+    async def disconnect(self, *, force=False):
+        self.is_connected = False
+
+    async def destroy(self):
+        self._cancel_end()
+        self.is_connected = False
+        self.node._players.pop(self.guild.id, None)
+
+class FakeVoiceChannel():
+    def __init__(self, guild, node):
+        self.id = next(_ids)
+        self.guild = guild
+        self.node = node
+
+    async def connect(self, *, cls=None, **kwargs):
+        #cls is the pomice player class the cog picked, the fake node stands in for whichever node it chose
+        player = FakeLavaPlayer(self.node, self.guild, self)
+        self.guild.voice_client = player
+        return player
+
+class FakeResponse():
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.sent += 1
+
+class FakeInteraction():
+    #one per command, shares guild, channel and author the way a real slash command would
+    def __init__(self, bot, guild, channel, author):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.response = FakeResponse(self)
+        self.sent = 0
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+    async def delete_original_message(self):
+        pass
+
+class FakeGuild():
+    def __init__(self, guild_id, bot, node):
+        self.id = guild_id
+        self.voice_client = None
+        self.channel = FakeTextChannel(self)
+        self.voice_channel = FakeVoiceChannel(self, node)
+        self.author = SimpleNamespace(id=next(_ids), mention="@listener", bot=False, voice=SimpleNamespace(channel=self.voice_channel))
+        self.bot = bot
+
+    def interaction(self):
+        return FakeInteraction(self.bot, self, self.channel, self.author)
+
+class FakeBot():
+    def __init__(self, loop):
+        self.loop = loop
+        self.ready = True
+        self.voice_clients = []
+
+    async def get_context(self, message, **kwargs):
+        return SimpleNamespace(message=message, author=None)
+
+    def dispatch(self, event, *args, **kwargs):
+        pass
+
+def install():
+    #swaps the gateway bound menu for the fake one, everything else runs through the real classes
+    lib.music.player.PlayerMenu = FakeMenu
@@ -0,0 +1,59 @@
+#throughput of MicroBatcher in front of intent prediction
+#run from the repo root: python -m benchmarks.intent_batch
+#uses a stand in predictor with keras like fixed per call cost, --real loads model.intent_model instead
+import argparse
+import asyncio
+import time
+
+from lib.util.asynctools import MicroBatcher
+
+class FakeModel():
+    def __init__(self, call_cost, item_cost):
+        self.call_cost = call_cost
+        self.item_cost = item_cost
+
+    def intents(self, sentences):
+        time.sleep(self.call_cost + self.item_cost*len(sentences))
+        return ["PlayMusic"]*len(sentences)
+
+async def run(model, messages, senders, max_batch, max_delay):
+    batcher = MicroBatcher(model.intents, max_batch=max_batch, max_delay=max_delay)
+    latencies = []
+
+    async def sender(count):
+        for n in range(count):
+            start = time.perf_counter()
+            await batcher.submit(f"play song number {n} by someone")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[sender(messages//senders) for _ in range(senders)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return len(latencies)/elapsed, latencies[len(latencies)//2], latencies[int(len(latencies)*.99)], batcher.stats()["avg_batch"]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=512)
+    parser.add_argument("--senders", type=int, default=32)
+    parser.add_argument("--call-cost", type=float, default=0.03, help="fixed seconds per predict call")
+    parser.add_argument("--item-cost", type=float, default=0.002, help="extra seconds per sentence in a batch")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 16, 32])
+    parser.add_argument("--delay", type=float, default=0.005)
+    parser.add_argument("--real", action="store_true")
+    args = parser.parse_args()
+
+    if args.real:
+        from model import intent_model
+        model = intent_model()
+    else:
+        model = FakeModel(args.call_cost, args.item_cost)
+
+    print(f"{args.messages} messages from {args.senders} senders, max_delay {args.delay*1000:.1f}ms")
+    for max_batch in args.batch:
+        throughput, p50, p99, avg_batch = asyncio.run(run(model, args.messages, args.senders, max_batch, args.delay))
+        print(f"  max_batch {max_batch:3}: {throughput:8.1f} msg/s  p50 {p50*1000:7.1f}ms  p99 {p99*1000:7.1f}ms  avg batch {avg_batch:5.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#offline accuracy/latency trade-off of the n-gram tier in front of bert, on test.csv
+#run from the repo root: python -m benchmarks.intent_cascade
+#without --bert the bert tier is assumed right with a fixed --bert-latency, with it the real model is scored too
+import argparse
+import csv
+import time
+
+from lib.nlp.cascade import NgramClassifier
+
+def load(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    return [row["text"] for row in rows], [row["intent"] for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train", nargs="+", default=["train.csv", "valid.csv"])
+    parser.add_argument("--test", default="test.csv")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.8, 0.9, 0.95, 0.99, 0.999])
+    parser.add_argument("--bert", action="store_true", help="load model.intent_model and score the fallback tier for real")
+    parser.add_argument("--bert-latency", type=float, default=0.25, help="seconds per bert call when --bert isnt given")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fast = NgramClassifier.fit_csv(*args.train)
+    print(f"trained n-gram tier on {', '.join(args.train)} in {time.perf_counter() - start:.2f}s")
+
+    texts, labels = load(args.test)
+
+    start = time.perf_counter()
+    predictions = [fast.predict(text) for text in texts]
+    fast_latency = (time.perf_counter() - start)/len(texts)
+
+    bert_labels, bert_latency = None, args.bert_latency
+    if args.bert:
+        from model import intent_model
+        model = intent_model()
+        start = time.perf_counter()
+        bert_labels = [model.intents([text])[0] for text in texts]
+        bert_latency = (time.perf_counter() - start)/len(texts)
+        print(f"bert alone: {sum(p == l for p, l in zip(bert_labels, labels))/len(labels):.2%} accuracy, {bert_latency*1000:.1f}ms/msg")
+
+    fast_accuracy = sum(label == truth for (label, _), truth in zip(predictions, labels))/len(labels)
+    print(f"n-gram alone: {fast_accuracy:.2%} accuracy, {fast_latency*1e6:.1f}us/msg on {len(texts)} test messages")
+
+    for threshold in args.thresholds:
+        answered = [(n, label) for n, (label, confidence) in enumerate(predictions) if confidence >= threshold]
+        coverage = len(answered)/len(texts)
+        fast_correct = sum(label == labels[n] for n, label in answered)
+        fast_part = fast_correct/len(answered) if answered else 0.0
+
+        answered_ids = {n for n, _ in answered}
+        if bert_labels:
+            bert_correct = sum(bert_labels[n] == labels[n] for n in range(len(texts)) if n not in answered_ids)
+        else:
+            bert_correct = len(texts) - len(answered) #upper bound, bert assumed right
+
+        accuracy = (fast_correct + bert_correct)/len(texts)
+        latency = fast_latency + (1 - coverage)*bert_latency
+        print(f"  threshold {threshold:<6}: n-gram answers {coverage:6.1%} ({fast_part:6.2%} right), cascade {accuracy:6.2%} accuracy{'' if bert_labels else ' (upper bound)'}, {latency*1000:7.2f}ms/msg avg")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#float vs int8 intent model: memory, single message latency and test.csv accuracy
+#run from the repo root after training: python -m benchmarks.intent_quantized
+#each variant loads in its own process so the memory numbers dont overlap
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        import os
+        return pages*os.sysconf("SC_PAGE_SIZE")/2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def measure(variant, test_path, limit):
+    with open(test_path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))[:limit or None]
+
+    before = rss_mb()
+    start = time.perf_counter()
+    from model import intent_model
+    model = intent_model(quantized=variant == "int8")
+    load_time = time.perf_counter() - start
+    loaded = rss_mb()
+
+    model.intents([rows[0]["text"]]) #warm up
+    latencies, correct = [], 0
+    for row in rows:
+        start = time.perf_counter()
+        label = model.intents([row["text"]])[0]
+        latencies.append(time.perf_counter() - start)
+        correct += label == row["intent"]
+
+    latencies.sort()
+    return {
+        "variant": variant,
+        "load_s": load_time,
+        "model_mb": loaded - before,
+        "peak_mb": rss_mb(),
+        "p50_ms": latencies[len(latencies)//2]*1000,
+        "p99_ms": latencies[int(len(latencies)*.99)]*1000,
+        "accuracy": correct/len(rows),
+        "samples": len(rows),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", default="test.csv")
+    parser.add_argument("--limit", type=int, default=0, help="only score the first n rows")
+    parser.add_argument("--variant", choices=["float", "int8"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.test, args.limit)))
+        return
+
+    results = []
+    for variant in ("float", "int8"):
+        out = subprocess.run([sys.executable, "-m", "benchmarks.intent_quantized", "--variant", variant, "--test", args.test, "--limit", str(args.limit)],
+            capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{'':>6} {'load':>8} {'model':>10} {'rss':>10} {'p50':>9} {'p99':>9} {'accuracy':>9}")
+    for r in results:
+        print(f"{r['variant']:>6} {r['load_s']:7.1f}s {r['model_mb']:8.0f}MB {r['peak_mb']:8.0f}MB {r['p50_ms']:7.1f}ms {r['p99_ms']:7.1f}ms {r['accuracy']:9.2%}")
+
+if __name__ == "__main__":
+    main()
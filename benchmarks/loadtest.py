@@ -0,0 +1,140 @@
+#drives the real music cog with fake guilds, lavalink and discord, no network needed
+#only the lavalink path is covered, there is no ytdl fake so lava=False setups arent exercised
+#run from the repo root: python -m benchmarks.loadtest --guilds 500 --duration 30
+import argparse
+import asyncio
+import functools
+import os
+import random
+import tempfile
+import time
+
+from benchmarks import fakes
+from lib.cogs import music
+from lib.cogs.music import Music
+from lib.music.cache import TrackCache
+from lib.music.player import PlayerWindow
+from lib.music.snapshot import SnapshotStore
+
+COMMANDS = {"play": 0.55, "skip": 0.2, "shuffle": 0.15, "stop": 0.1}
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return "no samples"
+    ordered = sorted(samples)
+    values = [ordered[min(len(ordered) - 1, int(len(ordered)*p/100))] for p in points]
+    return ", ".join(f"p{p} {value*1000:.2f}ms" for p, value in zip(points, values)) + f", max {ordered[-1]*1000:.2f}ms ({len(ordered)} samples)"
+
+async def monitor_lag(samples, interval, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+async def wait_for_playback(guild, timeout):
+    try:
+        await asyncio.wait_for(guild.voice_client.started.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+async def drive_guild(cog, guild, args, results, stop):
+    rng = random.Random(guild.id)
+    names, weights = list(COMMANDS), list(COMMANDS.values())
+    command = "play"
+
+    while not stop.is_set():
+        interaction = guild.interaction()
+        context = cog.player_contexts.get(guild.id)
+        #only commands that should start a track count towards command to playback
+        expects_playback = (command == "play" and not (context and context.current)) or (command == "skip" and context and context.current and not context.queue.empty())
+        if guild.voice_client:
+            guild.voice_client.started.clear()
+
+        start = time.perf_counter()
+        if command == "play":
+            await Music._play.callback(cog, interaction, query=f"guild {guild.id} song {rng.randrange(10**6)}")
+        else:
+            await getattr(Music, f"_{command}").callback(cog, interaction)
+        results["commands"].setdefault(command, []).append(time.perf_counter() - start)
+
+        if expects_playback:
+            if await wait_for_playback(guild, args.playback_timeout):
+                results["playback"].append(time.perf_counter() - start)
+            else:
+                results["timeouts"] += 1
+
+        await asyncio.sleep(rng.expovariate(1/args.interval))
+        command = rng.choices(names, weights)[0]
+
+async def run(args):
+    fakes.install()
+    loop = asyncio.get_running_loop()
+    bot = fakes.FakeBot(loop)
+    node = fakes.FakeNode(speed=args.speed, resolve_delay=args.resolve_delay)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        #patched before the cog is built, so it never opens the real databases in lib/bot
+        music.TrackCache = functools.partial(TrackCache, os.path.join(tmp, "trackcache.db"))
+        music.SnapshotStore = functools.partial(SnapshotStore, os.path.join(tmp, "snapshots.db"))
+        try:
+            cog = Music(bot)
+        finally:
+            music.TrackCache, music.SnapshotStore = TrackCache, SnapshotStore
+        cog.nodes.nodes[node._identifier] = node
+        node.on_track_end = cog.on_pomice_track_end
+
+        guilds = [fakes.FakeGuild(guild_id, bot, node) for guild_id in range(1, args.guilds + 1)]
+        results = {"commands": {}, "playback": [], "timeouts": 0}
+        lag = []
+        stop = asyncio.Event()
+
+        monitor = loop.create_task(monitor_lag(lag, args.lag_interval, stop))
+        drivers = [loop.create_task(drive_guild(cog, guild, args, results, stop)) for guild in guilds]
+
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*drivers, return_exceptions=True)
+        await monitor
+
+        contexts = list(cog.player_contexts.values())
+        memory = [cog.context_memory(context) for context in contexts]
+
+        print(f"{args.guilds} guilds for {args.duration}s at {args.speed}x track speed")
+        print(f"event loop lag: {percentiles(lag)}")
+        for command, samples in results["commands"].items():
+            print(f"{command:>8} handler: {percentiles(samples)}")
+        print(f"command to playback: {percentiles(results['playback'])}, {results['timeouts']} timed out")
+        if memory:
+            print(f"memory per guild: {sum(memory)/len(memory)/1024:.1f} KiB avg, {max(memory)/1024:.1f} KiB max ({len(memory)} contexts)")
+        print(f"tracks started: {sum(guild.voice_client.plays for guild in guilds if guild.voice_client)}")
+        print("player windows: {0[applied]} redraws ({0[requests]} edits) sent, {0[coalesced]} coalesced, {0[pending]} pending".format(PlayerWindow.updates.stats()))
+        print("track cache: {0[memory_hits]} memory / {0[disk_hits]} disk hits, {0[misses]} misses".format(cog.track_cache.stats()))
+
+        for context in contexts:
+            for task in (context._run_player_task, context._lookahead_task, context._ingest_task):
+                if task:
+                    task.cancel()
+        for guild in guilds:
+            if guild.voice_client:
+                await guild.voice_client.destroy()
+        cog.track_cache.close()
+        cog.snapshot_executor.shutdown()
+        cog.snapshots.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20, help="seconds to drive load for")
+    parser.add_argument("--interval", type=float, default=1.0, help="mean seconds between commands per guild")
+    parser.add_argument("--speed", type=float, default=600, help="track playback speedup, 600 plays a 3 minute song in 0.3s")
+    parser.add_argument("--resolve-delay", type=float, default=0.02, help="simulated lavalink search time")
+    parser.add_argument("--playback-timeout", type=float, default=5)
+    parser.add_argument("--lag-interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
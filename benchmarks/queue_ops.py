@@ -0,0 +1,78 @@
+#SongQueue operation costs at playlist scale
+#run from the repo root: python -m benchmarks.queue_ops --sizes 10000 100000
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from lib.music.queue import SongQueue
+
+class Item:
+    __slots__ = ('title', 'requester', 'id')
+
+    def __init__(self, n):
+        self.title = f"song {n}"
+        self.requester = n % 50
+        self.id = None
+
+class DequeQueue(asyncio.Queue):
+    #the deque backed queue SongQueue used to be, kept here to compare against
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
+        return self._queue[item]
+
+    def __len__(self):
+        return self.qsize()
+
+    def remove(self, index):
+        del self._queue[index]
+
+    def move(self, index, to):
+        item = self._queue[index]
+        del self._queue[index]
+        self._queue.insert(to, item)
+
+    def insert(self, index, item):
+        self._queue.insert(index, item)
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start)/repeat*1e6
+
+def bench(queue_cls, size, repeat):
+    queue = queue_cls()
+    start = time.perf_counter()
+    for n in range(size):
+        queue.put_nowait(Item(n))
+    results = {"put": (time.perf_counter() - start)/size*1e6}
+
+    rand = lambda : random.randrange(len(queue))
+    results["getitem"] = timed(lambda : queue[rand()], repeat)
+    results["page"] = timed(lambda : queue[size//2:size//2 + 10], repeat)
+    results["insert"] = timed(lambda : queue.insert(rand(), Item(-1)), repeat)
+    results["remove"] = timed(lambda : queue.remove(rand()), repeat)
+    results["move"] = timed(lambda : queue.move(rand(), rand()), repeat)
+    if hasattr(queue, "find"):
+        results["find"] = timed(lambda : queue.find(title=f"song {rand()}"), repeat)
+        results["index"] = timed(lambda : queue.index(queue[rand()].id), repeat)
+    results["get"] = timed(queue.get_nowait, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        print(f"{size} entries (us/op)")
+        old, new = bench(DequeQueue, size, args.repeat), bench(SongQueue, size, args.repeat)
+        for op, value in new.items():
+            print(f"  {op:>8}: {value:9.2f} indexed  {old[op]:9.2f} deque" if op in old else f"  {op:>8}: {value:9.2f} indexed  {'-':>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#idle guild benchmark for SongQueue.item_available
+#run from the repo root: python -m benchmarks.queue_wait --contexts 5000
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from lib.music.queue import SongQueue
+from benchmarks.queue_ops import Item
+
+class TimedItem(Item):
+    #SongQueue indexes items by id, title and requester, so the enqueue time rides along on one
+    __slots__ = ('enqueued_at',)
+
+    def __init__(self, n):
+        super().__init__(n)
+        self.enqueued_at = time.perf_counter()
+
+class PollingQueue(SongQueue):
+    #what item_available used to do, kept here to compare against
+    async def item_available(self):
+        while 1:
+            if not self.empty():
+                return True
+
+            await asyncio.sleep(.5)
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+        self.callbacks = 0
+
+    def _run_once(self):
+        self.iterations += 1
+        super()._run_once()
+
+    def call_soon(self, *args, **kwargs):
+        self.callbacks += 1
+        return super().call_soon(*args, **kwargs)
+
+    def call_at(self, *args, **kwargs):
+        self.callbacks += 1
+        return super().call_at(*args, **kwargs)
+
+async def idle_context(queue, latencies, timeout):
+    try:
+        await asyncio.wait_for(queue.item_available(), timeout)
+    except asyncio.TimeoutError:
+        return
+    item = queue.get_nowait()
+    latencies.append(time.perf_counter() - item.enqueued_at)
+
+async def run(queue_cls, contexts, idle_seconds, plays):
+    loop = asyncio.get_running_loop()
+    queues = [queue_cls() for _ in range(contexts)]
+    latencies = []
+    tasks = [loop.create_task(idle_context(queue, latencies, idle_seconds*4)) for queue in queues]
+
+    await asyncio.sleep(0.1) #let every context reach its wait
+    start_iterations, start_callbacks, start = loop.iterations, loop.callbacks, time.perf_counter()
+    await asyncio.sleep(idle_seconds)
+    elapsed = time.perf_counter() - start
+    idle_rate = ((loop.iterations - start_iterations)/elapsed, (loop.callbacks - start_callbacks)/elapsed)
+
+    for n, queue in enumerate(random.sample(queues, plays)):
+        queue.put_nowait(TimedItem(n))
+        await asyncio.sleep(random.uniform(0, 0.01))
+
+    while len(latencies) < plays:
+        await asyncio.sleep(0.01)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return idle_rate, latencies
+
+def report(name, idle_rate, latencies):
+    latencies = sorted(latencies)
+    p = lambda q : latencies[min(len(latencies) - 1, int(q*len(latencies)))]*1000
+    print(f"{name:>8}: {idle_rate[0]:8.1f} loop wakeups/s, {idle_rate[1]:9.1f} callbacks/s while idle, enqueue->wake p50 {p(.5):7.2f}ms p99 {p(.99):7.2f}ms max {latencies[-1]*1000:7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contexts", type=int, default=5000)
+    parser.add_argument("--idle", type=float, default=3.0, help="seconds to sample wakeups with every context idle")
+    parser.add_argument("--plays", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.contexts} idle contexts, {args.plays} songs enqueued")
+    for name, queue_cls in (("polling", PollingQueue), ("event", SongQueue)):
+        loop = CountingLoop()
+        try:
+            idle_rate, latencies = loop.run_until_complete(run(queue_cls, args.contexts, args.idle, args.plays))
+        finally:
+            loop.close()
+        report(name, idle_rate, latencies)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#restores a snapshot with deleted tracks in it and checks the rest of the queue still plays
+#run from the repo root: python -m benchmarks.restore_stale
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks import fakes
+from lib.music.player import PlayerContext
+from lib.music.snapshot import HibernatedContext
+
+async def run(args):
+    fakes.install()
+    loop = asyncio.get_running_loop()
+    bot = fakes.FakeBot(loop)
+    node = fakes.FakeNode(speed=args.speed)
+    guild = fakes.FakeGuild(1, bot, node)
+
+    references = [f"https://www.youtube.com/watch?v=restored{n:05}" for n in range(args.tracks)]
+    node.missing = set(references[::args.every]) #includes the head of the queue, the worst spot to fail
+
+    async def resolver(context, query):
+        return await node.get_tracks(query)
+
+    context = PlayerContext(guild.interaction(), bot, lava_enabled=True, resolver=resolver)
+    context.restore(HibernatedContext([(reference, f"Restored song {n}") for n, reference in enumerate(references)], 50, False))
+    context.player = await guild.voice_channel.connect()
+
+    async def track_end(player, track, reason):
+        context._playback_finished()
+    node.on_track_end = track_end
+
+    #the first /play after a restart, queued behind the restored songs
+    start = time.perf_counter()
+    await context.play((await node.get_tracks("first song after restart"))[0])
+
+    expected = 1 + len(references) - len(node.missing)
+    while guild.voice_client.plays < expected and time.perf_counter() - start < args.timeout:
+        if context._run_player_task.done():
+            break
+        await asyncio.sleep(0.01)
+
+    alive = not context._run_player_task.done()
+    plays = guild.voice_client.plays
+    print(f"{len(references)} restored, {len(node.missing)} unresolvable: {plays}/{expected} played in {time.perf_counter() - start:.2f}s, player loop {'alive' if alive else 'dead'}")
+
+    context._cancel_lookahead()
+    context._run_player_task.cancel()
+    await guild.voice_client.destroy()
+    return alive and plays == expected
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--every", type=int, default=3, help="every nth restored track is gone")
+    parser.add_argument("--speed", type=float, default=6000)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
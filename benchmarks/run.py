@@ -0,0 +1,256 @@
+#hot path suite, writes results as json and compares them with a stored baseline
+#run from the repo root: python -m benchmarks.run
+#first run on a machine: python -m benchmarks.run --save-baseline
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+RESULTS_FILE = "benchmarks/results.json"
+BASELINE_FILE = "benchmarks/baseline.json"
+TOLERANCE = 0.25 #slower than baseline by more than this fraction counts as a regression
+
+CASES = {}
+
+def case(name, number):
+    #setup(size) returns the callable to time, anything it raises on import means the case gets skipped
+    def inner(setup):
+        CASES[name] = (setup, number)
+        return setup
+    return inner
+
+def finish(coro):
+    #drives a coroutine that never really suspends, skips event loop overhead for pure cpu paths
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+def fake_tracks(count):
+    from benchmarks.fakes import FakeNode
+    node = FakeNode()
+    return [finish(node.get_tracks(f"benchmark song {n}"))[0] for n in range(count)]
+
+def queue_items(count):
+    from benchmarks.queue_ops import Item
+    return [Item(n) for n in range(count)]
+
+def full_queue(size):
+    from lib.music.queue import SongQueue
+    queue = SongQueue()
+    queue.extend(queue_items(size))
+    return queue
+
+@case("queue.extend", number=5)
+def queue_extend(size):
+    from lib.music.queue import SongQueue
+    items = queue_items(size)
+    return lambda : SongQueue().extend(items)
+
+@case("queue.get_put", number=20000)
+def queue_get_put(size):
+    queue = full_queue(size)
+    return lambda : queue.put_nowait(queue.get_nowait())
+
+@case("queue.page", number=20000)
+def queue_page(size):
+    queue = full_queue(size)
+    return lambda : queue.page(size//20)
+
+@case("queue.insert_remove", number=20000)
+def queue_insert_remove(size):
+    queue = full_queue(size)
+    item = queue_items(1)[0]
+    def op():
+        queue.insert(size//2, item)
+        queue.remove(size//2)
+    return op
+
+@case("queue.move", number=20000)
+def queue_move(size):
+    queue = full_queue(size)
+    return lambda : queue.move(10, size - 10)
+
+@case("queue.index", number=20000)
+def queue_index(size):
+    queue = full_queue(size)
+    track_id = queue[size//2].id
+    return lambda : queue.index(track_id)
+
+@case("queue.shuffle", number=5)
+def queue_shuffle(size):
+    queue = full_queue(size)
+    return queue.shuffle
+
+@case("source.parse_duration", number=100000)
+def parse_duration(size):
+    from lib.music.source import YTDLSource
+    durations = [random.Random(n).randrange(0, 200000) for n in range(1000)]
+    it = iter(durations*1000)
+    return lambda : YTDLSource.parse_duration(next(it))
+
+@case("song.create", number=5000)
+def song_create(size):
+    from lib.music.player import Song, LavaSourceAdapter
+    track = fake_tracks(1)[0]
+    return lambda : Song(LavaSourceAdapter(track))
+
+@case("song.create_embed", number=200000)
+def song_create_embed(size):
+    from lib.music.player import Song, LavaSourceAdapter
+    song = Song(LavaSourceAdapter(fake_tracks(1)[0]))
+    return song.create_embed
+
+@case("adapter.thumbnail", number=50000)
+def adapter_thumbnail(size):
+    from lib.music.player import LavaSourceAdapter
+    track = fake_tracks(1)[0]
+    return lambda : LavaSourceAdapter(track).thumbnail #fresh adapter, so the cached_property really runs
+
+@case("context.play_list", number=3)
+def context_play_list(size):
+    from benchmarks import fakes
+    from lib.music.player import PlayerContext
+    fakes.install()
+    loop = asyncio.new_event_loop()
+    bot = fakes.FakeBot(loop)
+    node = fakes.FakeNode()
+    tracks = fake_tracks(size)
+
+    async def play():
+        guild = fakes.FakeGuild(1, bot, node)
+        resolver = lambda context, reference : node.get_tracks(reference) #stubs only keep the reference
+        context = PlayerContext(guild.interaction(), bot, lava_enabled=True, resolver=resolver)
+        context.player = await guild.voice_channel.connect()
+        await context.play(tracks)
+        while context._ingest_task: #until the whole list is queued, not just the first song
+            await asyncio.sleep(0)
+        context._cancel_lookahead()
+        context._run_player_task.cancel()
+        await guild.voice_client.destroy()
+
+    return lambda : loop.run_until_complete(play())
+
+@case("command.player_slash_command", number=50000)
+def player_slash_command_overhead(size):
+    from types import SimpleNamespace
+    from lib.util.decorators import player_slash_command
+
+    async def play(self, interaction, query):
+        pass
+
+    context = SimpleNamespace()
+    cog = SimpleNamespace(get_player_context=lambda interaction : context)
+    command = player_slash_command(name="benchmark")(play)
+    interaction = SimpleNamespace()
+    return lambda : finish(command.callback(cog, interaction, query="never gonna give you up"))
+
+@case("command.direct_call", number=50000)
+def direct_call(size):
+    #what player_slash_command.callback is measured against
+    async def play(self, interaction, query):
+        pass
+
+    cog, interaction = object(), object()
+    return lambda : finish(play(cog, interaction, query="never gonna give you up"))
+
+@case("intent.preprocess", number=1)
+def intent_preprocess(size):
+    import pandas as pd
+    from model import IntentDetectionData, tokenizer
+
+    phrases = ["play never gonna give you up", "skip this song", "what is the weather like tomorrow", "add some lofi beats to my queue"]
+    intents = ["PlayMusic", "PlayMusic", "GetWeather", "AddToPlaylist"]
+    rows = min(size, 20000)
+    frame = lambda : pd.DataFrame({"text": [f"{phrases[n % 4]} {n}" for n in range(rows)], "intent": [intents[n % 4] for n in range(rows)]})
+    train, test = frame(), frame()
+    classes = sorted(set(intents))
+
+    def op():
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()): #tqdm and the seq len print
+            IntentDetectionData(train, test, tokenizer, classes, max_seq_len=128)
+    return op
+
+def run_cases(size, repeat, only=None):
+    results, skipped = {}, {}
+    for name, (setup, number) in CASES.items():
+        if only and not any(part in name for part in only):
+            continue
+        try:
+            func = setup(size)
+        except Exception as ex: #mostly missing optional deps, like tensorflow for the intent case
+            skipped[name] = repr(ex)
+            print(f"{name:>30}: skipped ({repr(ex)})")
+            continue
+
+        seconds = min(timeit.Timer(func).repeat(repeat=repeat, number=number))/number
+        results[name] = seconds
+        print(f"{name:>30}: {seconds*1e6:12.2f}us")
+    return results, skipped
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'case':>30}  {'baseline':>12}  {'current':>12}  change")
+    for name, seconds in results.items():
+        if name not in baseline:
+            print(f"{name:>30}  {'-':>12}  {seconds*1e6:10.2f}us  new")
+            continue
+        change = seconds/baseline[name] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:>30}  {baseline[name]*1e6:10.2f}us  {seconds*1e6:10.2f}us  {change:+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000, help="queue and playlist length")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per case, the fastest one is kept")
+    parser.add_argument("--only", nargs="+", help="run cases whose name contains any of these")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results, skipped = run_cases(args.size, args.repeat, args.only)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "size": args.size,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+    with open(args.save_baseline and args.baseline or args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        if not args.save_baseline:
+            print(f"\nNo baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("size") != args.size:
+        print(f"\nBaseline was taken with --size {baseline['meta'].get('size')}, comparing anyway")
+
+    if regressions := compare(results, baseline["results"], args.tolerance):
+        print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#warm restart cost of queue snapshots
+#run from the repo root: python -m benchmarks.snapshot_restore --guilds 10000
+import argparse
+import os
+import tempfile
+import time
+
+from lib.music.snapshot import HibernatedContext, SnapshotStore
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--tracks", type=int, default=25, help="queued tracks per guild")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshots.db")
+        records = {
+            guild_id: HibernatedContext([(f"https://www.youtube.com/watch?v={guild_id:06}{n:05}", f"Song {n} for guild {guild_id}") for n in range(args.tracks)], 80, False)
+            for guild_id in range(args.guilds)
+        }
+
+        store = SnapshotStore(path)
+        start = time.perf_counter()
+        store.save_many(records)
+        print(f"save {args.guilds} guilds x {args.tracks} tracks: {time.perf_counter() - start:.3f}s ({os.path.getsize(path)/2**20:.1f} MiB)")
+        store.close()
+
+        start = time.perf_counter()
+        store = SnapshotStore(path)
+        guilds = store.guild_ids()
+        print(f"startup (open + guild ids): {(time.perf_counter() - start)*1000:.1f}ms for {len(guilds)} guilds")
+
+        start = time.perf_counter()
+        store.load(args.guilds//2)
+        print(f"lazy restore of one guild: {(time.perf_counter() - start)*1e6:.0f}us")
+
+        start = time.perf_counter()
+        for guild_id in guilds:
+            store.load(guild_id)
+        print(f"restore every guild: {time.perf_counter() - start:.3f}s")
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#cost of building the now playing embed on a player window refresh
+#run from the repo root: python -m benchmarks.window_refresh
+import argparse
+import timeit
+from types import SimpleNamespace
+
+import disnake
+
+from lib.music.player import Song, LavaSourceAdapter
+from lib.music.source import YTDLSource
+
+def rebuilt_embed(song):
+    #what every refresh used to do, new adapter lookups and a new embed each time
+    adapter = LavaSourceAdapter(song.track.source)
+    return (disnake.Embed(title='```{0}\n```'.format(adapter.title), color=disnake.Color.blurple())
+    .set_image(url=adapter.thumbnail)
+    .set_author(name="Now playing")
+    .set_footer(text="Duration - "+YTDLSource.parse_duration(int(song.track.source.length/1000))))
+
+def rebuilt_empty():
+    return (disnake.Embed(title='```No Current Songs In Queue\n```', color=disnake.Color.blurple())
+    .set_image(url='https://www.clipartmax.com/png/middle/307-3076576_song-clipart-music-bar-paper.png')
+    .set_author(name="Now playing"))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    track = SimpleNamespace(title="Rick Astley - Never Gonna Give You Up (Official Music Video)",
+        thumbnail="https://i.ytimg.com/vi/dQw4w9WgXcQ/mqdefault.jpg", length=213000)
+    song = Song(LavaSourceAdapter(track))
+
+    cases = {
+        "song rebuilt": lambda : rebuilt_embed(song),
+        "song cached": song.create_embed,
+        "empty rebuilt": rebuilt_empty,
+        "empty cached": Song.create_empty_embed,
+        "song to_dict": lambda : song.create_embed().to_dict(), #what an edit serializes either way
+    }
+    for name, func in cases.items():
+        seconds = timeit.timeit(func, number=args.number)
+        print(f"{name:>14}: {seconds/args.number*1e6:8.2f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#starts the bot as several worker processes, each running its own event loop for a slice of the shards
+#python launcher.py --clusters 4 [--shards 16] [--ml]
+#each cluster serves its own /metrics on METRICS_PORT + cluster id, so scrape the whole range
+import argparse
+import json
+import math
+import multiprocessing
+import time
+import urllib.request
+from multiprocessing.connection import wait
+
+from lib.version import VERSION
+
+CLUSTERS = 2
+HEARTBEAT_TIMEOUT = 30 #seconds without a heartbeat before a worker counts as hung
+STARTUP_TIMEOUT = 180 #grace for a fresh worker to log in and send its first heartbeat
+RESTART_DELAY = 5 #doubles with each crash in a row, up to 2**5 times
+STABLE_AFTER = 300 #seconds a worker has to stay up before its crash streak resets
+
+def read_token():
+    with open("./lib/bot/token", "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+def recommended_shards(token):
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}", "User-Agent": "melo launcher"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+def split_shards(shard_count, clusters):
+    per = math.ceil(shard_count/clusters)
+    return [list(range(start, min(start + per, shard_count))) for start in range(0, shard_count, per)]
+
+def worker(cluster_id, shard_ids, shard_count, conn, enable_ml):
+    #runs in the child process, imports the bot here so the launcher itself stays light
+    from lib.bot import Bot
+    from lib.bot.cluster import ClusterClient
+
+    bot = Bot(shard_ids=shard_ids, shard_count=shard_count)
+    bot.cluster = ClusterClient(bot, conn, cluster_id, shard_ids, shard_count)
+    bot.cluster.start()
+    print(f"Cluster {cluster_id} starting with shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    bot.run(VERSION, enable_ml)
+
+class Cluster():
+    def __init__(self, cluster_id, shard_ids):
+        self.id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.conn = None
+        self.started_at = None
+        self.last_heartbeat = None
+        self.stats = {}
+        self.failures = 0
+        self.restart_at = None
+
+class Launcher():
+    def __init__(self, shard_count, clusters, enable_ml):
+        self.ctx = multiprocessing.get_context("spawn") #fresh interpreter per worker, nothing inherited from the launcher
+        self.shard_count = shard_count
+        self.enable_ml = enable_ml
+        self.clusters = [Cluster(n, shard_ids) for n, shard_ids in enumerate(split_shards(shard_count, clusters))]
+
+    def start(self, cluster):
+        parent, child = self.ctx.Pipe()
+        cluster.process = self.ctx.Process(target=worker, args=(cluster.id, cluster.shard_ids, self.shard_count, child, self.enable_ml), name=f"melo-cluster-{cluster.id}", daemon=False)
+        cluster.process.start()
+        child.close()
+        cluster.conn = parent
+        cluster.started_at = time.monotonic()
+        cluster.last_heartbeat = None
+        cluster.restart_at = None
+
+    def stop(self, cluster, reason):
+        print(f"Cluster {cluster.id} {reason}, restarting")
+        if cluster.process.is_alive():
+            cluster.process.terminate()
+            cluster.process.join(10)
+            if cluster.process.is_alive():
+                cluster.process.kill()
+                cluster.process.join()
+        cluster.conn.close()
+        cluster.conn = None
+
+        stable = time.monotonic() - cluster.started_at >= STABLE_AFTER
+        cluster.failures = 0 if stable else cluster.failures + 1
+        cluster.restart_at = time.monotonic() + RESTART_DELAY*2**min(cluster.failures, 5)
+
+    def check(self, cluster):
+        now = time.monotonic()
+        if cluster.conn is None:
+            if now >= cluster.restart_at:
+                self.start(cluster)
+            return
+
+        if not cluster.process.is_alive():
+            self.stop(cluster, f"exited with code {cluster.process.exitcode}")
+        elif cluster.last_heartbeat is None and now - cluster.started_at > STARTUP_TIMEOUT:
+            self.stop(cluster, "never sent a heartbeat")
+        elif cluster.last_heartbeat is not None and now - cluster.last_heartbeat > HEARTBEAT_TIMEOUT:
+            self.stop(cluster, f"missed heartbeats for {now - cluster.last_heartbeat:.0f}s")
+
+    def send(self, cluster, message):
+        try:
+            cluster.conn.send(message)
+        except (OSError, EOFError):
+            pass #dead worker, check() picks it up
+
+    def handle(self, cluster, message):
+        op = message.get("op")
+        if op == "heartbeat":
+            cluster.last_heartbeat = time.monotonic()
+            cluster.stats = message["stats"]
+        elif op == "stats":
+            stats = {other.id: {**other.stats, "alive": other.conn is not None} for other in self.clusters}
+            self.send(cluster, {"op": "reply", "id": message["id"], "data": stats})
+        elif op == "report":
+            print(f"[cluster {cluster.id}] {message['text']}")
+        elif op == "broadcast":
+            for other in self.clusters:
+                if other.conn is not None:
+                    self.send(other, {"op": "event", "event": message["event"], "data": message.get("data")})
+
+    def run(self):
+        for cluster in self.clusters:
+            self.start(cluster)
+
+        try:
+            while 1:
+                conns = {cluster.conn: cluster for cluster in self.clusters if cluster.conn is not None}
+                for conn in wait(list(conns), timeout=1):
+                    try:
+                        message = conn.recv()
+                    except (OSError, EOFError):
+                        continue #pipe closed, the process check below restarts it
+                    self.handle(conns[conn], message)
+
+                for cluster in self.clusters:
+                    self.check(cluster)
+        except KeyboardInterrupt:
+            print("Stopping clusters...")
+        finally:
+            for cluster in self.clusters:
+                if cluster.conn is not None:
+                    self.send(cluster, {"op": "shutdown"})
+            for cluster in self.clusters:
+                if cluster.process and cluster.process.is_alive():
+                    cluster.process.join(15)
+                    if cluster.process.is_alive():
+                        cluster.process.terminate()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters", type=int, default=CLUSTERS)
+    parser.add_argument("--shards", type=int, help="total shard count, asks discord for its recommendation if left out")
+    parser.add_argument("--ml", action="store_true", help="load the nlp models in every worker")
+    args = parser.parse_args()
+
+    shard_count = args.shards
+    if shard_count is None:
+        try:
+            shard_count = recommended_shards(read_token())
+        except Exception as ex:
+            print(f"Couldnt get the recommended shard count: {repr(ex)}, using one per cluster")
+            shard_count = args.clusters
+
+    clusters = min(args.clusters, shard_count)
+    print(f"Launching {clusters} clusters for {shard_count} shards")
+    Launcher(shard_count, clusters, args.ml).run()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,61 @@
 from glob import glob
 from asyncio import sleep
-from disnake.ext.commands import Bot as BotBase
+from collections import deque
+from enum import Enum
+import asyncio
+import threading
+import time
+import os
+from disnake.ext.commands import AutoShardedBot as BotBase
 from disnake.ext.commands import CommandNotFound, Context, MissingRequiredArgument
 from disnake.http import HTTPException, Forbidden
+from lib.util.asynctools import MicroBatcher, BoundedExecutor
+from lib.nlp.extract import MISS
+from lib.util.metrics import start_server
+from lib.util.lagmonitor import LagMonitor
+from lib.util.memory import rss
+from lib.music.source import YTDLSource
 import disnake
 
 PREFIX = "?"
 OWNER_IDS = [226939988070236161]
 COGS = [path.split("/")[-1][:-3].split("\\")[-1] for path in glob("./lib/cogs/*.py")]
 
-Intents=disnake.Intents.all()
+INTENT_PROFILE = "minimal" #"all" brings back every intent and a full member cache, for comparing against
+
+def gateway_options(profile):
+    if profile == "all":
+        return {"intents": disnake.Intents.all(), "member_cache_flags": disnake.MemberCacheFlags.all(), "chunk_guilds_at_startup": True}
+
+    #voice states for who is in which channel, messages and content for prefix commands and the owner nlp path
+    intents = disnake.Intents(guilds=True, voice_states=True, guild_messages=True, message_content=True, dm_messages=True)
+    #only members sitting in voice get cached, thats all the music commands look at
+    return {"intents": intents, "member_cache_flags": disnake.MemberCacheFlags(voice=True, joined=False), "chunk_guilds_at_startup": False}
+
+INTENT_BATCH_SIZE = 16 #max owner messages classified in one predict call
+INTENT_BATCH_DELAY = 0.005 #seconds to wait for more messages before predicting
+
+#serve the int8 tflite export instead of the float keras model. unverified: the conversion of the bert model and its Lambda layer
+#and benchmarks.intent_quantized have never been run, so run both and compare accuracy before turning this on
+INTENT_QUANTIZED = False
+INTENT_FAST_MODEL = "intent_ngram.json" #trained from train.csv and valid.csv on first load
+INTENT_FAST_THRESHOLD = 0.95 #n-gram confidence needed to skip bert, 1.1 sends everything to bert
+
+NLP_WORKERS = 2 #threads for keras intent prediction
+#query extraction always gets one thread of its own, the stanza pipeline and spacy vocab/matcher arent thread safe
+NLP_CONCURRENCY = 4 #owner messages allowed in the nlp path at once
+NLP_TIMEOUT = 10 #seconds before an owner message is given up on
+
+RESOLVER_WORKERS = 4 #threads running youtube_dl lookups, per cluster under launcher.py
+
+METRICS_HOST = "127.0.0.1" #prometheus text endpoint at /metrics, local only
+METRICS_PORT = 9108 #None turns the endpoint off, under launcher.py cluster n listens on METRICS_PORT + n
+
+class MLState(Enum):
+    DISABLED = 0
+    LOADING = 1
+    READY = 2
+    FAILED = 3
 
 class CogReady(object):
     def __init__(self):
@@ -24,47 +70,105 @@ class CogReady(object):
         return all([getattr(self, cog) for cog in COGS])
 
 class Bot(BotBase):
-    def __init__(self):
+    def __init__(self, **options): #shard_ids and shard_count come from launcher.py, left out one process runs every shard
         self.PREFIX = PREFIX
         self.ready = False
         self.cogs_ready = CogReady()
        
+        self.ml_state = MLState.DISABLED
+        self._boot_time = None
+        self._first_command = False
+
         self.nlp = None
         self.model = None
-        self.matcher = None
+        self.intent_batcher = None
+        self.intent_cascade = None
+        self.extractor = None
+        self.nlp_pool = None
+        self.parse_pool = None
+        self._nlp_slots = asyncio.Semaphore(NLP_CONCURRENCY)
+        self.nlp_latency = {stage: deque(maxlen=256) for stage in ("intent", "extract", "invoke", "total")}
+        self.metrics_server = None
+        self.lag_monitor = None
+        self.cluster = None #ClusterClient when started by launcher.py
 
-        super().__init__(command_prefix=PREFIX, owner_ids=OWNER_IDS, intents=Intents, auto_sync_commands=True)
+        super().__init__(command_prefix=PREFIX, owner_ids=OWNER_IDS, auto_sync_commands=True, **gateway_options(INTENT_PROFILE), **options)
 
     def setup(self, enable_ml):
+        YTDLSource.configure_resolver(RESOLVER_WORKERS)
         for cog in COGS:
             self.load_extension(f"lib.cogs.{cog}")
             print(f"{cog} cog loaded".capitalize())
             
 
         if enable_ml:
+            #loads on its own thread so the bot can connect and play music while the nlp stack warms up
+            self.ml_state = MLState.LOADING
+            threading.Thread(target=self._load_ml, name="ml-loader", daemon=True).start()
+
+    def _load_ml(self):
+        start = time.perf_counter()
+        print("Loading NLP models...")
+
+        try:
             import stanza
             from spacy_stanza import StanzaLanguage
             from spacy.matcher import Matcher
 
             from model import intent_model
+            from lib.nlp.extract import QueryExtractor
+            from lib.nlp.cascade import NgramClassifier, IntentCascade
             
             snlp = stanza.Pipeline(lang='en')
-            self.nlp = StanzaLanguage(snlp)
-            self.model = intent_model()
+            nlp = StanzaLanguage(snlp)
+            model = intent_model(quantized=INTENT_QUANTIZED)
+
+            self.extractor = QueryExtractor(nlp, Matcher)
+            self.nlp_pool = BoundedExecutor(NLP_WORKERS, name="nlp")
+            self.parse_pool = BoundedExecutor(1, name="parse")
+            self.intent_batcher = MicroBatcher(model.intents, max_batch=INTENT_BATCH_SIZE, max_delay=INTENT_BATCH_DELAY, executor=self.nlp_pool)
 
-            self.matcher = Matcher(self.nlp.vocab)
+            if os.path.exists(INTENT_FAST_MODEL):
+                fast = NgramClassifier.load(INTENT_FAST_MODEL)
+            else:
+                fast = NgramClassifier.fit_csv("train.csv", "valid.csv")
+                fast.save(INTENT_FAST_MODEL)
+            self.intent_cascade = IntentCascade([(fast, INTENT_FAST_THRESHOLD)], fallback=self.intent_batcher.submit)
+            self.nlp = nlp
+            self.model = model
+        except Exception as ex:
+            self.ml_state = MLState.FAILED
+            print(f"Failed to load NLP models: {repr(ex)}")
+        else:
+            self.ml_state = MLState.READY
+            print(f"NLP models ready in {time.perf_counter() - start:.2f}s")
 
     def run(self, version, enable_ml):
         self.VERSION = version
+        self._boot_time = time.perf_counter()
 
         print("Setup running...")
         self.setup(enable_ml)
         with open("./lib/bot/token", "r", encoding="utf-8") as f:
             self.TOKEN = f.read()
 
+        self.lag_monitor = LagMonitor(self.loop) #started before connecting so startup stalls show up too
+        self.lag_monitor.start()
+
         print("Bot starting...")
         super().run(self.TOKEN, reconnect=True)
 
+    async def close(self):
+        for extension in list(self.extensions): #lets cogs flush state, like the music queue snapshots
+            self.unload_extension(extension)
+        if self.metrics_server:
+            await self.metrics_server.cleanup()
+        if self.lag_monitor:
+            self.lag_monitor.stop()
+        if self.cluster:
+            self.cluster.stop()
+        await super().close()
+
     async def on_connect(self):
         print("Bot connected!")
 
@@ -93,12 +197,49 @@ class Bot(BotBase):
             while not self.cogs_ready.all_ready():
                 await sleep(0.5)
             self.ready = True
-            print("Bot ready")
+            if METRICS_PORT is not None:
+                try:
+                    port = METRICS_PORT + (self.cluster.cluster_id if self.cluster else 0) #every cluster keeps its own registry
+                    self.metrics_server = await start_server(METRICS_HOST, port)
+                except OSError as ex:
+                    print(f"Metrics endpoint failed to start: {repr(ex)}")
+            print(f"Bot ready in {time.perf_counter() - self._boot_time:.2f}s (ml: {self.ml_state.name.lower()})")
+            self._report_cache()
             
             
         else:
             print("Bot reconnected")
 
+    def _report_cache(self):
+        guilds = self.guilds
+        members = sum(len(guild.members) for guild in guilds)
+        total = sum(guild.member_count or 0 for guild in guilds) #what the all profile would end up caching once chunked
+        voice = sum(len(guild._voice_states) for guild in guilds)
+        memory = rss()
+        print(f"Cache ({INTENT_PROFILE} intents): {len(guilds)} guilds, {members}/{total} members, {len(self.users)} users, "
+            f"{voice} voice states, {len(self.cached_messages)} messages" + (f", rss {memory/2**20:.0f} MiB" if memory else ""))
+
+    def cluster_stats(self):
+        music = self.get_cog("Music")
+        contexts = music.player_contexts.values() if music else ()
+        return {
+            "shards": list(self.shard_ids or self.shards),
+            "guilds": len(self.guilds),
+            "latency": self.latency,
+            "players": len(contexts),
+            "playing": sum(1 for context in contexts if context.current),
+            "loop_lag_p99": self.lag_monitor.percentiles().get(99, 0) if self.lag_monitor else 0,
+            "rss": rss(),
+        }
+
+    def _report_first_command(self):
+        if not self._first_command:
+            self._first_command = True
+            print(f"First command after {time.perf_counter() - self._boot_time:.2f}s (ml: {self.ml_state.name.lower()})")
+
+    async def on_slash_command(self, interaction):
+        self._report_first_command()
+
     async def on_message(self, message):
         if message.author.bot: return
         await self.process_commands(message)
@@ -107,43 +248,43 @@ class Bot(BotBase):
         ctx = await self.get_context(message, cls=Context)
         if ctx.command is not None and ctx.guild is not None:
             if self.ready:
+                self._report_first_command()
                 await self.invoke(ctx)
                 await ctx.message.delete()
             else:
                 await ctx.send("Bot still starting, please wait a few moments...")
         elif message.author.id in OWNER_IDS:
-            if not self.model:
+            if self.ml_state is not MLState.READY:
                 return
 
 
-            intent = self.model.intent(message.content)[-1]
-            
-            if intent == "PlayMusic":
-                pattern = [[{"POS": "VERB"},{"OP": "?"}, {"OP": "?"},{"OP": "?"}, {"LOWER": "by"},{"OP": "?"},  {"OP": "?"}],
-                [{"POS": "VERB"},{"OP": "?"}, {"OP": "?"},{"OP": "?"}]
-                ]
-                
-                self.matcher.add("songbypattern", pattern)
-
-                doc = self.nlp(message.content)
-                matches = self.matcher(doc)
-                #for letter, token in zip(message.content.split(" "), doc):
-                #    print(f"{letter}:{token.pos_}-{token.ent_type_}")
-                if len(matches) == 0:
-                    return
-
-                diff = [ match[-1] - match[-2] for match in matches ]
-                idx = diff.index(max(diff)) #finds biggest match
-                _, start, end = matches[idx]
-                span = doc[start:end]
-
-                cmd = " ".join(span.text.split(" ")[1:]) #just removes the verb, like "play" from the search query
-                
-                for word, token in zip(message.content.split(" "), doc):
-
-                    if token.pos_ == "VERB" and word in cmd:
-                        cmd = cmd.replace(word, "")[1:]
-                        break
-                
+            start = time.perf_counter()
+            try:
+                async with self._nlp_slots:
+                    #only understanding the message is bounded, the command it turns into runs to completion
+                    cmd, intent_done = await asyncio.wait_for(self._process_nlp(message), NLP_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"NLP timed out after {NLP_TIMEOUT}s")
+                return
+            extract_done = time.perf_counter()
+
+            if cmd:
                 await ctx.invoke(self.get_command('play'), query=cmd)
-bot = Bot()
\ No newline at end of file
+            done = time.perf_counter()
+
+            self._record_nlp(intent=intent_done - start, extract=extract_done - intent_done, invoke=done - extract_done, total=done - start)
+
+    async def _process_nlp(self, message):
+        intent = await self.intent_cascade.classify(message.content)
+        intent_done = time.perf_counter()
+
+        cmd = None
+        if intent == "PlayMusic":
+            cmd = self.extractor.lookup(message.content) #seen phrases skip the parse and matcher entirely
+            if cmd is MISS:
+                cmd = await self.parse_pool.run(self.extractor.extract, message.content)
+        return cmd, intent_done
+
+    def _record_nlp(self, **stages):
+        for stage, seconds in stages.items():
+            self.nlp_latency[stage].append(seconds)
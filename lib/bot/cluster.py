@@ -0,0 +1,87 @@
+import asyncio
+import itertools
+import threading
+import time
+
+#worker side of launcher.py, talks to the launcher over a multiprocessing pipe
+class ClusterClient():
+    HEARTBEAT_INTERVAL = 5 #seconds between heartbeats, the launcher restarts a worker that goes quiet
+    REQUEST_TIMEOUT = 5
+
+    def __init__(self, bot, conn, cluster_id, shard_ids, shard_count):
+        self.bot = bot
+        self.conn = conn
+        self.cluster_id = cluster_id
+        self.shard_ids = set(shard_ids)
+        self.shard_count = shard_count
+
+        self._requests = {} #request id -> future waiting on the launchers reply
+        self._ids = itertools.count()
+        self._heartbeat_task = None
+
+    def start(self):
+        self._heartbeat_task = self.bot.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._reader, name="cluster-ipc", daemon=True).start()
+
+    def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    def send(self, op, **data):
+        try:
+            self.conn.send({"op": op, "cluster": self.cluster_id, **data})
+        except (OSError, EOFError, BrokenPipeError) as ex:
+            print(f"Cluster {self.cluster_id} lost the launcher: {repr(ex)}")
+
+    async def _heartbeat(self):
+        #sent from the loop on purpose, a blocked loop stops the heartbeats and gets the worker restarted
+        while 1:
+            self.send("heartbeat", stats=self.bot.cluster_stats(), time=time.time())
+            await asyncio.sleep(ClusterClient.HEARTBEAT_INTERVAL)
+
+    def _reader(self):
+        while 1:
+            try:
+                message = self.conn.recv()
+            except (OSError, EOFError):
+                return #launcher is gone, the worker keeps serving its shards until it gets stopped
+            self.bot.loop.call_soon_threadsafe(self._handle, message)
+
+    def _handle(self, message):
+        op = message.get("op")
+        if op == "reply":
+            future = self._requests.pop(message["id"], None)
+            if future and not future.done():
+                future.set_result(message["data"])
+        elif op == "event":
+            #cogs listen with on_cluster_<event>
+            self.bot.dispatch(f"cluster_{message['event']}", message.get("data"))
+        elif op == "shutdown":
+            self.bot.loop.create_task(self.bot.close())
+
+    def owns_guild(self, guild_id):
+        return (guild_id >> 22) % self.shard_count in self.shard_ids #discords shard formula
+
+    async def request(self, op, **data):
+        request_id = next(self._ids)
+        future = self.bot.loop.create_future()
+        self._requests[request_id] = future
+        self.send(op, id=request_id, **data)
+        try:
+            return await asyncio.wait_for(future, ClusterClient.REQUEST_TIMEOUT)
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def cluster_stats(self):
+        #cluster id -> latest heartbeat stats, this worker included
+        return await self.request("stats")
+
+    def report(self, text):
+        #shows up in the launchers log, for results of broadcast commands
+        print(f"Cluster {self.cluster_id}: {text}")
+        self.send("report", text=text)
+
+    def broadcast(self, event, data=None):
+        #every cluster, this one included, dispatches on_cluster_<event>
+        self.send("broadcast", event=event, data=data)
@@ -1,11 +1,18 @@
 from disnake.ext.commands import Cog
-from disnake.ext.commands import command
+from disnake.ext.commands import command, is_owner
+from lib.util.memory import instance_stats, MallocTracker, MAX_SIZED
 import disnake
 #import openai
 
 class Meta(Cog):
+    #music holds live players, node connections and background loops, reloading it would strand every playing guild
+    RELOADABLE = ("fun", "meta")
+    LAG_FIELDS = 5 #stalls shown by ?lag at most
+    LAG_STACK_CHARS = 4000 #stack text shared between those fields, field values cap at 1024 each
+
     def __init__(self, bot):
         self.bot = bot
+        self.malloc = MallocTracker()
 
     @Cog.listener()
     async def on_ready(self):
@@ -17,6 +24,129 @@ class Meta(Cog):
         embed=disnake.Embed(title="melo", description="Next-Gen Music Bot \n \n by Meschdog18")
         await ctx.send(embed=embed)
 
+    @command(name="nlpstats", hidden=True)
+    @is_owner()
+    async def nlp_stats(self, ctx):
+        if not self.bot.extractor:
+            return await ctx.send(f"NLP not loaded ({self.bot.ml_state.name.lower()})")
+
+        embed = disnake.Embed(title="NLP stats", color=disnake.Color.blurple())
+        for stage, samples in self.bot.nlp_latency.items():
+            samples = sorted(samples)
+            if samples:
+                embed.add_field(name=stage, value=f"p50 {samples[len(samples)//2]*1000:.1f}ms\np99 {samples[int(len(samples)*.99)]*1000:.1f}ms", inline=True)
+
+        stats = self.bot.extractor.stats()
+        embed.add_field(name="extract cache", value=f"{stats['hit_rate']:.0%} hit rate ({stats['hits']}/{stats['hits'] + stats['misses']})\n"
+            f"{stats['entries']} entries, p50 {stats['p50']*1000:.2f}ms, max {stats['max']*1000:.1f}ms", inline=False)
+        await ctx.send(embed=embed)
+
+    @command(name="lag", hidden=True)
+    @is_owner()
+    async def lag(self, ctx, count: int = 5):
+        monitor = self.bot.lag_monitor
+        if not monitor:
+            return await ctx.send("Lag monitor not running")
+
+        points = monitor.percentiles()
+        embed = disnake.Embed(title="Event loop lag", description=" / ".join(f"p{p} {seconds*1000:.1f}ms" for p, seconds in points.items()) + f"\n{monitor.stalls} stalls over {monitor.threshold*1000:.0f}ms", color=disnake.Color.blurple())
+        stalls = monitor.worst()[:max(1, min(count, Meta.LAG_FIELDS))]
+        budget = min(980, Meta.LAG_STACK_CHARS//max(1, len(stalls))) #split so the whole embed stays under discords 6000 characters
+        for stall in stalls:
+            stack = "".join(stall.stack[-4:]) if stall.stack else "ended before the watchdog caught it\n"
+            embed.add_field(name=f"{stall.duration*1000:.0f}ms", value=f"<t:{int(stall.started)}:T>\n```{stack[-budget:]}```", inline=False)
+        await ctx.send(embed=embed)
+
+    def tracked_types(self):
+        from lib.music.player import PlayerContext, PlayerWindow, Song, SongStub, YTDLSourceAdapter, LavaSourceAdapter
+        from lib.music.source import YTDLSource
+        from lib.menu import PlayerMenu
+        return [PlayerContext, Song, SongStub, YTDLSourceAdapter, LavaSourceAdapter, PlayerWindow, PlayerMenu, YTDLSource]
+
+    def shared_objects(self):
+        #reachable from almost everything, counting them would make every type look like it owns the whole bot
+        shared = [self.bot, self.bot.loop, getattr(self.bot, "_connection", None)]
+        if music := self.bot.get_cog("Music"):
+            shared.extend([music, music.track_cache, music.nodes, *music.nodes.nodes.values()])
+        return [obj for obj in shared if obj is not None]
+
+    @command(name="clusters", hidden=True)
+    @is_owner()
+    async def clusters(self, ctx):
+        if not self.bot.cluster:
+            return await ctx.send("Not running under launcher.py")
+
+        embed = disnake.Embed(title="Clusters", color=disnake.Color.blurple())
+        for cluster_id, stats in sorted((await self.bot.cluster.cluster_stats()).items()):
+            if not stats.get("alive") or "guilds" not in stats:
+                embed.add_field(name=f"Cluster {cluster_id}", value="down", inline=True)
+                continue
+            embed.add_field(name=f"Cluster {cluster_id}" + (" (this one)" if cluster_id == self.bot.cluster.cluster_id else ""),
+                value=f"shards {stats['shards'][0]}-{stats['shards'][-1]}\n{stats['guilds']} guilds, {stats['latency']*1000:.0f}ms\n"
+                f"{stats['playing']}/{stats['players']} playing\nlag p99 {stats['loop_lag_p99']*1000:.0f}ms" + (f"\n{stats['rss']/2**20:.0f} MiB" if stats["rss"] else ""), inline=True)
+        await ctx.send(embed=embed)
+
+    @command(name="broadcast", hidden=True)
+    @is_owner()
+    async def broadcast(self, ctx, event: str, *, data: str = None):
+        if not self.bot.cluster:
+            return await ctx.send("Not running under launcher.py")
+        self.bot.cluster.broadcast(event, data)
+        await ctx.send(f"Sent `{event}` to every cluster")
+
+    @Cog.listener()
+    async def on_cluster_reload(self, extension):
+        #?broadcast reload fun, picks up changes to a stateless cog on every cluster without a restart
+        if extension not in Meta.RELOADABLE:
+            return self.bot.cluster.report(f"refused to reload {extension!r}, only {', '.join(Meta.RELOADABLE)} can be reloaded")
+
+        try:
+            self.bot.reload_extension(f"lib.cogs.{extension}")
+        except Exception as ex:
+            self.bot.cluster.report(f"failed to reload {extension}: {repr(ex)}")
+        else:
+            self.bot.cluster.report(f"reloaded {extension}")
+
+    @command(name="mem", hidden=True, help="types scans every live object, it yields to the loop as it goes but the scan itself can take a few seconds on a big bot. "
+        "start/snap/diff/top/stop drive tracemalloc, which slows every allocation down while it runs")
+    @is_owner()
+    async def mem(self, ctx, action: str = "types", limit: int = 10):
+        if action == "types":
+            from reactionmenu import ViewMenu
+
+            embed = disnake.Embed(title="Memory by type", color=disnake.Color.blurple())
+            for name, (count, size) in (await instance_stats(self.tracked_types(), exclude=self.shared_objects())).items():
+                embed.add_field(name=name, value=f"{count} live\n{size/1024:.1f} KiB", inline=True)
+
+            embed.add_field(name="disnake cache", value=f"{len(self.bot.guilds)} guilds, {len(self.bot.users)} users, "
+                f"{sum(len(guild.members) for guild in self.bot.guilds)} members, {len(self.bot.cached_messages)} messages", inline=False)
+            embed.add_field(name="menu sessions", value=f"{len(ViewMenu._active_sessions)} active", inline=False)
+            embed.set_footer(text=f"Sizes are approximate, shared objects like the bot are left out, past {MAX_SIZED} instances they are extrapolated")
+            return await ctx.send(embed=embed)
+
+        if action == "start":
+            self.malloc.start()
+            return await ctx.send("tracemalloc started, baseline taken")
+
+        if not self.malloc.running:
+            return await ctx.send("tracemalloc is off, start it with `mem start`")
+
+        if action == "stop":
+            self.malloc.stop()
+            return await ctx.send("tracemalloc stopped")
+
+        if action == "snap":
+            self.malloc.snapshot()
+            return await ctx.send("New baseline taken")
+
+        if action in ("diff", "top"):
+            stats = self.malloc.diff(limit) if action == "diff" else self.malloc.top(limit)
+            current, peak = self.malloc.traced()
+            lines = "\n".join(str(stat) for stat in stats) or "no change"
+            return await ctx.send(f"traced {current/2**20:.1f} MiB (peak {peak/2**20:.1f} MiB)\n```{lines[:1900]}```")
+
+        await ctx.send("Usage: mem [types|start|snap|diff|top|stop] [limit]")
+
 
     """
     @command(name="talk", aliases=["t"])
@@ -1,28 +1,50 @@
 from disnake.ext.commands import Cog
 from disnake.ext.commands import command, slash_command
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 import disnake
 import youtube_dl
 import pomice
 import json
+import time
+import sqlite3
+import asyncio
 from disnake.utils import get
 import sys
 from lib.util.decorators import player_slash_command
 from lib.music.source import YTDLSource, YTDLError
+from lib.music.cache import TrackCache
+from lib.music.snapshot import SnapshotStore
+from lib.music.nodes import NodeManager
+from lib.util.memory import deep_sizeof
+from lib.util.asynctools import BoundedExecutor
+from lib.util.metrics import metrics
 
 # Suppress noise about console usage from errors
 youtube_dl.utils.bug_reports_message = lambda: ''
 msg_delete_time = 3
 
-from lib.music.player import PlayerContext, Song
+from lib.music.player import PlayerContext, PlayerWindow, Song
 
 class Music(Cog):
+    IDLE_TIMEOUT = 60*15 #seconds without activity before a stopped or paused player context gets hibernated, along with its queue
+    REAP_INTERVAL = 60
+    SNAPSHOT_INTERVAL = 30 #seconds between writing changed queues to disk
+    LATENCY_METRICS = {"play_to_audio": "Play to audio", "resolve": "Resolve", "queue_wait": "Queue wait", "window_update": "Window update"}
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.player_contexts = {}
+        self.hibernated = {} #guild id -> HibernatedContext, only until the next snapshot save puts it on disk
+        self.snapshots = SnapshotStore()
+        self.snapshot_executor = BoundedExecutor(1, name="snapshots") #one writer, a slow disk cant eat the shared default pool
+        #rows are only read once that guild uses the bot again, other clusters guilds are left to them
+        self.snapshot_guilds = self.snapshots.guild_ids(bot.cluster.owns_guild if bot.cluster else None)
+        self._snapshot_signatures = {}
+        self._dropped_snapshots = set()
         self.lava = True
         self.pomice = pomice.NodePool()
-        self.node = None
+        self.nodes = NodeManager(bot, self.pomice)
+        self.track_cache = TrackCache()
 
         
     def load_config(self, filename):
@@ -30,73 +52,207 @@ class Music(Cog):
             return json.load(f)  
     
     async def start_nodes(self):    
-        config = self.load_config("lib/bot/lavanode.json")
+        config = await self.bot.loop.run_in_executor(None, self.load_config, "lib/bot/lavanode.json")
          
         await self.bot.wait_until_ready()
 
-        if self.pomice.nodes:
+        if self.nodes.nodes:
             return
         
-        print("Connecting to lavalink node...")
+        print("Connecting to lavalink nodes...")
 
-        try:
-            self.node = self.pomice.get_best_node(algorithm=pomice.NodeAlgorithm.by_ping)
-        except pomice.NoNodesAvailable:
-            print("No node found, creating one now...")
+        if not await self.nodes.start(config):
+            print("No lavalink node available, Using basic player instead")
+            self.lava = False
+            return
 
-            try:
-                self.node = await self.pomice.create_node(
-                    bot=self.bot,
-                    host=config.get("ip"),
-                    port=config.get("port"),
-                    password=config.get("password"),
-                    identifier="MAIN"
-                    )
-            except Exception as ex:
-                print(f"Failed to connect to lavalink node: {repr(ex)}, Using basic player instead")
-                self.lava = False
-                return
-            else:
-                print("Node created")
-
-        
-        print("Node connected")
+        print(f"{len(self.nodes.nodes)} node(s) connected")
 
 
     @commands.Cog.listener()
     async def on_pomice_track_end(self, player, track, _):
         player_context = self.player_contexts.get(player.guild.id)
-        player_context._playback_finished()
+        if player_context:
+            player_context._playback_finished()
+
+    async def get_tracks(self, player_context, interaction, query):
+        if cached := await self.track_cache.get("lava", query):
+            tracks = [pomice.Track(track_id=track["track_id"], info=track["info"], ctx=interaction) for track in cached["tracks"]]
+            return tracks if cached["playlist"] else tracks[0]
+
+        result = await player_context.player.voice.get_tracks(query, ctx=interaction)
+        if not result:
+            raise YTDLError('Couldn\'t find anything that matches `{}`'.format(query))
+
+        playlist = isinstance(result, pomice.Playlist)
+        tracks = result.tracks if playlist else result[:1]
+        
+        self.track_cache.put("lava", [query] + ([] if playlist else [tracks[0].uri]), {
+            "playlist": playlist,
+            "tracks": [{"track_id": track.track_id, "info": track.info} for track in tracks]
+        })
+
+        return tracks if playlist else tracks[0]
+
+    async def resolve(self, player_context, query, interaction=None):
+        interaction = interaction or player_context._inter
+        with metrics.timer("resolve", player_context.guild_id): #cache hits included, they are what users feel
+            if player_context.lava_enabled:
+                return await self.get_tracks(player_context, interaction, query)
+            return await YTDLSource.create_source(interaction, query, loop=self.bot.loop, cache=self.track_cache)
 
     def get_player_context(self, interaction: disnake.CommandInteraction, reset=False):
         context = self.player_contexts.get(interaction.guild.id)
         if not context or reset:
-            context = PlayerContext(interaction ,self.bot, self.lava, self.node)
+            context = PlayerContext(interaction ,self.bot, self.lava, self.nodes.best_node() if self.lava else None, self.track_cache, self.resolve)
             self.player_contexts[interaction.guild.id] = context
 
+            if record := self.hibernated.pop(interaction.guild.id, None):
+                context.restore(record)
+            elif interaction.guild.id in self.snapshot_guilds: #read off the loop, the first play waits for it
+                context.restoring = self.bot.loop.create_task(self.load_snapshot(context))
+            self.snapshot_guilds.discard(interaction.guild.id)
+
+        context.touch()
         return context
 
+    async def load_snapshot(self, context):
+        try:
+            record = await self.snapshot_executor.run(self.snapshots.load, context.guild_id, loop=self.bot.loop)
+        except sqlite3.OperationalError as e:
+            print(f"Snapshot load for guild {context.guild_id} failed: {repr(e)}")
+            return
+        if record:
+            context.restore(record)
+
+    @tasks.loop(seconds=REAP_INTERVAL)
+    async def reap_contexts(self):
+        for guild_id, context in list(self.player_contexts.items()):
+            if not context.is_idle(Music.IDLE_TIMEOUT):
+                continue
+
+            del self.player_contexts[guild_id]
+            self._snapshot_signatures.pop(guild_id, None)
+            metrics.drop_guild(guild_id)
+            record = await context.hibernate()
+            if guild_id in self.player_contexts: #someone used the bot again while a paused player was being torn down
+                if record:
+                    self.player_contexts[guild_id].restore(record)
+            elif record:
+                self.hibernated[guild_id] = record
+            else:
+                self._dropped_snapshots.add(guild_id)
+
+    def changed_snapshots(self):
+        changed = dict.fromkeys(self._dropped_snapshots, None) #saved as deletes
+        self._dropped_snapshots.clear()
+        for guild_id, context in self.player_contexts.items():
+            if context.restoring and not context.restoring.done():
+                continue #saving now would overwrite the row before it was read back
+            signature = context.snapshot_signature()
+            if self._snapshot_signatures.get(guild_id) != signature:
+                self._snapshot_signatures[guild_id] = signature
+                changed[guild_id] = context.snapshot()
+
+        for guild_id, record in self.hibernated.items():
+            if self._snapshot_signatures.get(guild_id) is not record:
+                self._snapshot_signatures[guild_id] = record
+                changed[guild_id] = record
+
+        return changed
+
+    @tasks.loop(seconds=SNAPSHOT_INTERVAL)
+    async def save_snapshots(self):
+        if not (changed := self.changed_snapshots()):
+            return
+        try:
+            await self.snapshot_executor.run(self.snapshots.save_many, changed, loop=self.bot.loop)
+        except sqlite3.OperationalError as e: #locked by another cluster, everything in this batch gets tried again next time
+            print(f"Snapshot save failed: {repr(e)}")
+            for guild_id, record in changed.items():
+                self._snapshot_signatures.pop(guild_id, None)
+                if record is None:
+                    self._dropped_snapshots.add(guild_id)
+            return
+
+        for guild_id, record in changed.items():
+            if record is not None and self.hibernated.get(guild_id) is record: #on disk now, the guild rehydrates through the store
+                del self.hibernated[guild_id]
+                self._snapshot_signatures.pop(guild_id, None)
+                self.snapshot_guilds.add(guild_id)
+
+    def cog_unload(self):
+        self.reap_contexts.cancel()
+        self.save_snapshots.cancel()
+        self.nodes.stop()
+        self.snapshot_executor.shutdown(wait=True) #lets a save thats already running finish before the last flush
+        self.snapshots.save_many(self.changed_snapshots())
+        self.snapshots.close()
+
+    def context_memory(self, context):
+        #bot, loop and shared caches arent owned by the context
+        return deep_sizeof(context, exclude=(self.bot, self.bot.loop, self.track_cache, self.nodes, *self.nodes.nodes.values(), context._resolver))
+
     async def cog_before_invoke(self, ctx: commands.Context):
         ctx.player_context = self.get_player_context(ctx)
         
     @Cog.listener()
     async def on_ready(self):
+        if not self.reap_contexts.is_running():
+            self.reap_contexts.start()
+        if not self.save_snapshots.is_running():
+            self.save_snapshots.start()
         if self.lava:
             await self.start_nodes()
         if not self.bot.ready:
             self.bot.cogs_ready.ready_up(__file__.split("/")[-1][:-3].split("\\")[-1]) 
 
+    @staticmethod
+    def latency_lines(guild_id=None):
+        lines = []
+        for name, label in Music.LATENCY_METRICS.items():
+            points = metrics.percentiles(name, guild_id)
+            lines.append(f"{label}: " + (" / ".join(f"{seconds*1000:.0f}ms" for seconds in points.values()) if points else "no data"))
+        return "\n".join(lines)
+
     @slash_command(name="stats") 
     async def _stats(self, ctx):
-        stats = self.pomice.get_node(identifier="MAIN").stats
-        await ctx.send(embed=(disnake.Embed(title="Node Stats", color=disnake.Color.dark_red()))
-        .add_field(name="CPU_CORES", value=stats.cpu_cores, inline=True)
-        .add_field(name="CPU_PROCESS_LOAD", value=stats.cpu_process_load, inline=True)
-        .add_field(name="ACTIVE_PLAYERS", value=stats.players_active, inline=True)
-        .add_field(name="TOTAL_PLAYERS", value=stats.players_total,inline=True))
+        if self.bot.cluster:
+            await ctx.response.defer() #the launcher can take longer than the 3s interaction window to answer
+        embed = disnake.Embed(title="Node Stats", color=disnake.Color.dark_red())
+        for identifier, node, penalty in self.nodes.stats():
+            stats = node.stats
+            if not node.is_connected or not stats:
+                embed.add_field(name=identifier, value="Disconnected", inline=False)
+                continue
+            embed.add_field(name=identifier, value=f"CPU: {stats.cpu_cores} cores, {stats.cpu_system_load:.0%} system / {stats.cpu_process_load:.0%} process\n"
+                f"Players: {stats.players_active} active / {stats.players_total} total\n"
+                f"Penalty: {penalty:.1f}", inline=False)
+
+        if self.bot.cluster:
+            try:
+                clusters = await self.bot.cluster.cluster_stats()
+            except asyncio.TimeoutError:
+                clusters = {}
+            if clusters:
+                embed.add_field(name="Clusters", value="\n".join(
+                    f"#{cluster_id}: " + (f"{stats['guilds']} guilds, {stats['playing']}/{stats['players']} playing, lag p99 {stats['loop_lag_p99']*1000:.0f}ms"
+                    if stats.get("alive") and "guilds" in stats else "down") for cluster_id, stats in sorted(clusters.items())) +
+                    f"\nTotal: {sum(stats.get('guilds', 0) for stats in clusters.values())} guilds, {sum(stats.get('playing', 0) for stats in clusters.values())} playing", inline=False)
+
+        embed.add_field(name="Latency p50 / p95 / p99", value=self.latency_lines(), inline=False)
+        if ctx.guild and ctx.guild.id in metrics.guilds:
+            embed.add_field(name="This server", value=self.latency_lines(ctx.guild.id), inline=False)
+
+        await ctx.send(embed=embed
+        .set_footer(text="Track cache: {0[memory_hits]} memory / {0[disk_hits]} disk hits, {0[misses]} misses\n"
+            "ytdl pool: {1[pending]} queued, {1[active]} active, avg wait {1[avg_wait]:.3f}s, avg run {1[avg_run]:.3f}s\n"
+            "Player windows: {2[applied]} redraws ({2[requests]} edits) sent, {2[coalesced]} saved\n"
+            "Node migrations: {3}, player timeouts: {4}".format(self.track_cache.stats(), YTDLSource.resolver.stats(), PlayerWindow.updates.stats(), self.nodes.migrations, metrics.counters["run_timeouts"])))
 
     @player_slash_command(guild_ids=[678809641597140992],name="play")
     async def _play(self, interaction: disnake.CommandInteraction, query):
+        requested = time.perf_counter()
         player_context = interaction.player_context
 
         building = not player_context._player_window
@@ -120,7 +276,7 @@ class Music(Cog):
                 player_context = self.get_player_context(interaction, reset=True)
                 if not player_context.player:
                     if player_context.lava_enabled:
-                        player_context.player = await channel.connect(cls=pomice.player.Player) 
+                        player_context.player = await channel.connect(cls=self.nodes.player_cls()) 
                     else:
                         player_context.player = await channel.connect() 
 
@@ -132,24 +288,18 @@ class Music(Cog):
                     player_context.player = interaction.voice_client
 
             if player_context.lava_enabled:
-                player_context.player = await channel.connect(cls=pomice.player.Player) 
+                player_context.player = await channel.connect(cls=self.nodes.player_cls()) 
             else:
                 player_context.player = await channel.connect() 
 
         try:
-            if player_context.lava_enabled:
-                source = await player_context.player.voice.get_tracks(query, ctx=interaction)
-                if isinstance(source, pomice.Playlist):
-                    source = source.tracks
-                else:
-                    source = (await player_context.player.voice.get_tracks(query, ctx=interaction))[0]
-            else:
-                source = await YTDLSource.create_source(interaction, query, loop=self.bot.loop)
+            source = await self.resolve(player_context, query, interaction)
         except YTDLError as e:
             await interaction.send('An error occurred while processing this request: {}'.format(str(e)),delete_after=msg_delete_time)
         else:
-            
-            await player_context.play(source)
+            if not player_context.current:
+                player_context.audio_requested = requested
+            await player_context.play(source, interaction.author)
         
         if building:
             await interaction.delete_original_message()
@@ -190,10 +340,45 @@ class Music(Cog):
     async def _shuffle(self, interaction: disnake.CommandInteraction):
 
         if not interaction.player_context.queue.empty():
-            interaction.player_context.queue.shuffle()
+            interaction.player_context.shuffle()
             await empty_response(interaction)
 
 
+    @player_slash_command(guild_ids=[678809641597140992],name="queue")
+    async def _queue(self, interaction: disnake.CommandInteraction, page: int = 1):
+        queue = interaction.player_context.queue
+
+        if queue.empty():
+            return await interaction.send("Queue is empty", delete_after=msg_delete_time)
+
+        songs, page, pages = queue.page(page)
+        start = (page - 1)*queue.PAGE_SIZE
+        lines = ["`{0}.` {1.title} `#{1.id}`".format(start + i + 1, song) for i, song in enumerate(songs)]
+
+        await interaction.send(embed=(disnake.Embed(title="Queue", description="\n".join(lines), color=disnake.Color.blurple())
+        .set_footer(text=f"Page {page}/{pages} - {len(queue)} songs")))
+
+    @player_slash_command(guild_ids=[678809641597140992],name="remove")
+    async def _remove(self, interaction: disnake.CommandInteraction, position: int):
+        queue = interaction.player_context.queue
+
+        if not 1 <= position <= len(queue):
+            return await interaction.send("No song at that position", delete_after=msg_delete_time)
+
+        song = queue.remove(position - 1)
+        song.cleanup()
+        await interaction.send(f"Removed {song.title}", delete_after=msg_delete_time)
+
+    @player_slash_command(guild_ids=[678809641597140992],name="move")
+    async def _move(self, interaction: disnake.CommandInteraction, position: int, to: int):
+        queue = interaction.player_context.queue
+
+        if not 1 <= position <= len(queue) or not 1 <= to <= len(queue):
+            return await interaction.send("No song at that position", delete_after=msg_delete_time)
+
+        song = queue.move(position - 1, to - 1)
+        await interaction.send(f"Moved {song.title} to {to}", delete_after=msg_delete_time)
+
     @player_slash_command(guild_ids=[678809641597140992],name="restart")
     async def _restart(self, interaction: disnake.CommandInteraction):
         await interaction.player_context.player.stop()
@@ -243,6 +428,17 @@ class Music(Cog):
 
 
     
+    @commands.command(name="contexts", hidden=True)
+    @commands.is_owner()
+    async def _contexts(self, ctx: commands.Context):
+        sizes = sorted(self.context_memory(context) for context in self.player_contexts.values())
+        hibernated = sum(deep_sizeof(record) for record in self.hibernated.values())
+
+        await ctx.send(embed=(disnake.Embed(title="Player Contexts", color=disnake.Color.dark_red())
+        .add_field(name="LIVE", value=f"{len(sizes)} using {sum(sizes)/1024:.1f} KiB", inline=True)
+        .add_field(name="PER_CONTEXT", value=f"avg {sum(sizes)/len(sizes)/1024 if sizes else 0:.1f} KiB, max {sizes[-1]/1024 if sizes else 0:.1f} KiB", inline=True)
+        .add_field(name="HIBERNATED", value=f"{len(self.hibernated)} using {hibernated/1024:.1f} KiB", inline=True)))
+
     @commands.command(name="_play_pause", hidden=True)
     async def _play_pause(self, ctx: commands.Context):
         player_context = self.get_player_context(ctx)
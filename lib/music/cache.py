@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+import threading
+import asyncio
+import sqlite3
+import json
+import time
+import re
+from lib.util.asynctools import BoundedExecutor
+
+#resolved tracks shared by the ytdl and lavalink backends, memory lru in front of a sqlite file
+#disk reads and writes run on their own thread, every cluster shares the file so a lock on it never stalls the loop
+class TrackCache():
+    MEMORY_SIZE = 512
+    DEFAULT_TTL = 60*60*24 #lavalink track ids dont expire, this just stops entries from getting too old
+    STREAM_TTL = 60*60 #used when a ytdl stream url doesnt say when it expires
+    STREAM_MARGIN = 60*10 #drop ytdl entries a bit before google expires the stream url
+    BUSY_TIMEOUT = 2 #seconds sqlite waits on another clusters write lock before giving up, a read that gives up is a miss
+
+    def __init__(self, path="lib/bot/trackcache.db", memory_size=MEMORY_SIZE):
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._writes = set() #pending disk writes, put doesnt wait on them
+
+        self._executor = BoundedExecutor(1, name="trackcache")
+        self._db = sqlite3.connect(path, timeout=TrackCache.BUSY_TIMEOUT, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL") #readers in other clusters dont block on a writer
+            self._db.execute("PRAGMA synchronous=NORMAL") #no fsync per commit, a crash can only lose the newest cache entries
+            self._db.execute("CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires REAL NOT NULL)")
+            try:
+                self._db.execute("DELETE FROM tracks WHERE expires <= ?", (time.time(),))
+                self._db.commit()
+            except sqlite3.OperationalError as e: #another cluster is writing, it gets cleaned up next start
+                print(f"Track cache cleanup skipped: {repr(e)}")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def normalize(query):
+        query = query.strip()
+        if re.match(r"^https?://", query):
+            return query #urls are case sensitive, youtube ids especially
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def stream_expiry(url):
+        if not url:
+            return None
+
+        parsed = urlparse(url)
+        expire = parse_qs(parsed.query).get("expire")
+        if expire:
+            return float(expire[0])
+
+        if match := re.search(r"/expire/(\d+)", parsed.path): #manifest style urls
+            return float(match.group(1))
+
+        return None
+
+    @classmethod
+    def stream_ttl(cls, url):
+        expires = cls.stream_expiry(url)
+        if expires is None:
+            return cls.STREAM_TTL
+        return expires - cls.STREAM_MARGIN - time.time()
+
+    def _key(self, backend, query):
+        return f"{backend}:{self.normalize(query)}"
+
+    async def get(self, backend, query):
+        key = self._key(backend, query)
+        now = time.time()
+
+        if entry := self._memory.get(key):
+            payload, expires = entry
+            if expires > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return payload
+            del self._memory[key]
+
+        try:
+            entry = await self._executor.run(self._load, key, now)
+        except sqlite3.OperationalError as e: #locked or busy, resolving again is cheaper than waiting
+            print(f"Track cache read failed: {repr(e)}")
+            self.errors += 1
+            entry = None
+
+        if entry:
+            payload, expires = entry
+            self._remember(key, payload, expires)
+            self.disk_hits += 1
+            return payload
+
+        self.misses += 1
+        return None
+
+    def _load(self, key, now):
+        with self._lock:
+            row = self._db.execute("SELECT payload, expires FROM tracks WHERE key = ?", (key,)).fetchone()
+            if row and row[1] <= now:
+                self._db.execute("DELETE FROM tracks WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, backend, queries, payload, ttl=DEFAULT_TTL):
+        #memory is updated right away, the disk write happens in the background
+        if ttl <= 0:
+            return
+
+        expires = time.time() + ttl
+        keys = {self._key(backend, query) for query in queries if query}
+
+        for key in keys:
+            self._remember(key, payload, expires)
+
+        task = asyncio.get_running_loop().create_task(self._write([(key, json.dumps(payload), expires) for key in keys]))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, rows):
+        try:
+            await self._executor.run(self._store, rows)
+        except Exception as e: #still in memory, only other clusters and restarts miss it
+            print(f"Track cache write failed: {repr(e)}")
+            self.errors += 1
+
+    def _store(self, rows):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO tracks (key, payload, expires) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def _remember(self, key, payload, expires):
+        self._memory[key] = (payload, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits/total if total else 0.0
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hit_rate,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True) #lets queued writes land first
+        with self._lock:
+            self._db.close()
\ No newline at end of file
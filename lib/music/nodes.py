@@ -0,0 +1,160 @@
+from collections import Counter
+from functools import partial
+import asyncio
+import pomice
+
+#lavalink nodes from lavanode.json, places players by load and moves them off nodes that go bad
+class NodeManager():
+    HEALTH_INTERVAL = 10 #seconds between node health checks
+    DEGRADED_PENALTY = 500 #penalty past which a node counts as degraded and its players get moved
+    DEGRADED_CHECKS = 3 #health checks in a row a node has to fail before anything gets moved off it
+    TARGET_PENALTY = 300 #only nodes well under DEGRADED_PENALTY take moved players, so they dont tip over and bounce them back
+    MAX_MIGRATIONS = 10 #players moved per health check, the rest wait for the next one
+
+    def __init__(self, bot, pool: pomice.NodePool):
+        self.bot = bot
+        self.pool = pool
+        self.nodes = {}
+        self.migrations = 0
+        self._failed_checks = Counter() #node identifier -> failed health checks in a row
+        self._moved_in = {} #node identifier -> (stats it was sent, players moved onto it since)
+        self._health_task = None
+
+    @staticmethod
+    def node_configs(config):
+        if "nodes" in config:
+            return config["nodes"]
+        return [{**config, "identifier": config.get("identifier", "MAIN")}] #old single node lavanode.json
+
+    async def start(self, config):
+        for node_config in self.node_configs(config):
+            identifier = node_config.get("identifier") or f"{node_config.get('ip')}:{node_config.get('port')}"
+            try:
+                self.nodes[identifier] = await self.pool.create_node(
+                    bot=self.bot,
+                    host=node_config.get("ip"),
+                    port=node_config.get("port"),
+                    password=node_config.get("password"),
+                    identifier=identifier
+                    )
+            except Exception as ex:
+                print(f"Failed to connect to lavalink node {identifier}: {repr(ex)}")
+            else:
+                print(f"Node {identifier} connected")
+
+        if self.nodes and not self._health_task:
+            self._health_task = self.bot.loop.create_task(self._health_loop())
+
+        return bool(self.nodes)
+
+    def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+
+    @staticmethod
+    def _frame_stats(stats):
+        #pomice doesnt always expose lavalinks frameStats, treat missing as healthy
+        deficit = getattr(stats, "frames_deficit", None)
+        nulled = getattr(stats, "frames_nulled", None)
+        return deficit or 0, nulled or 0
+
+    @classmethod
+    def penalty(cls, node):
+        if not node.is_connected or not node.stats:
+            return float("inf")
+
+        stats = node.stats
+        deficit, nulled = cls._frame_stats(stats)
+
+        #same weighting lavalink clients use for load balancing
+        players = stats.players_active
+        cpu = 1.05 ** (100*stats.cpu_system_load) * 10 - 10
+        deficit_penalty = 1.03 ** (500*(deficit/3000)) * 600 - 600 if deficit else 0
+        null_penalty = (1.03 ** (500*(nulled/3000)) * 300 - 300)*2 if nulled else 0
+
+        return players + cpu + deficit_penalty + null_penalty
+
+    def is_healthy(self, node):
+        return self.penalty(node) < NodeManager.DEGRADED_PENALTY
+
+    def best_node(self, exclude=None):
+        candidates = [node for node in self.nodes.values() if node is not exclude and node.is_connected]
+        if not candidates:
+            return None
+        return min(candidates, key=self.penalty)
+
+    def player_cls(self):
+        #channel.connect builds cls(client, channel), so the chosen node rides along in a partial
+        return partial(pomice.Player, node=self.best_node())
+
+    async def _health_loop(self):
+        while 1:
+            await asyncio.sleep(NodeManager.HEALTH_INTERVAL)
+            await self._rebalance()
+
+    async def _rebalance(self):
+        degraded = []
+        for identifier, node in self.nodes.items():
+            if self.is_healthy(node):
+                self._failed_checks.pop(identifier, None)
+            else:
+                self._failed_checks[identifier] += 1
+                if self._failed_checks[identifier] >= NodeManager.DEGRADED_CHECKS and node.players:
+                    degraded.append(node)
+
+        #lavalink only sends fresh stats about once a minute, until then players moved onto a node get added to its penalty by hand
+        penalties = {node: self.penalty(node) + self._pending(node) for node in self.nodes.values() if node not in degraded and not self._failed_checks[node._identifier]}
+        budget = NodeManager.MAX_MIGRATIONS
+        for node in degraded:
+            moved = 0
+            for player in list(node.players.values()):
+                if budget <= 0:
+                    break
+                target = min(penalties, key=penalties.get, default=None)
+                if target is None or penalties[target] + 1 >= NodeManager.TARGET_PENALTY:
+                    break
+                try:
+                    await self.migrate(player, target)
+                except Exception as ex:
+                    print(f"Failed to move player for guild {player.guild.id}: {repr(ex)}")
+                    continue
+                penalties[target] += 1
+                self._moved_in[target._identifier] = (target.stats, self._pending(target) + 1)
+                budget -= 1
+                moved += 1
+
+            left = len(node.players)
+            print(f"Node {node._identifier} degraded, moved {moved} players" + (f", {left} left for the next check" if left else ""))
+
+    def _pending(self, node):
+        stats, moved = self._moved_in.get(node._identifier, (None, 0))
+        return moved if stats is node.stats else 0 #new stats already count them
+
+    async def migrate(self, player, node):
+        #pomice has no public way to switch a players node, so this re-homes it by hand and resumes the track
+        old = player._node
+        track, position = player.current, player.position
+        paused, volume = player.is_paused, player.volume
+
+        old._players.pop(player.guild.id, None)
+        player._node = node
+        node._players[player.guild.id] = player
+
+        if old.is_connected:
+            try:
+                await old.send(op="destroy", guildId=str(player.guild.id))
+            except Exception:
+                pass
+
+        await player._dispatch_voice_update(player._voice_state)
+        if track:
+            await player.play(track, start=int(position))
+            await player.set_volume(volume)
+            if paused:
+                await player.set_pause(True)
+
+        self.migrations += 1
+
+    def stats(self):
+        return [(identifier, node, self.penalty(node)) for identifier, node in self.nodes.items()]
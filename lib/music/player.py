@@ -1,12 +1,16 @@
 from abc import ABC, abstractmethod
 from lib.menu import PlayerMenu
-from lib.music.source import YTDLSource
-from lib.util.asynctools import await_me_maybe
+from lib.music.source import YTDLSource, YTDLError
+from lib.music.queue import SongQueue
+from lib.music.snapshot import HibernatedContext
+from lib.util.asynctools import await_me_maybe, CoalescingScheduler
+from lib.util.metrics import metrics
+from collections import deque
+from functools import cached_property
 import asyncio
 from enum import Enum
-import random
-import itertools
 import disnake
+import time
 import re
 
 class VoiceError(Exception):
@@ -26,16 +30,22 @@ class PlayerWindowState(Enum):
 
 class PlayerContext():
     TIMEOUT = 60
+    LOOKAHEAD = 2 #how many queued songs get refreshed ahead of time, 0 turns it off
+    INGEST_CHUNK = 200 #playlist tracks queued per loop iteration
 
-    def __init__(self, interaction: disnake.CommandInteraction, bot, lava_enabled=False, lava_node=None):
+    def __init__(self, interaction: disnake.CommandInteraction, bot, lava_enabled=False, lava_node=None, track_cache=None, resolver=None):
         self._inter = interaction
         self._bot = bot
+        self.guild_id = interaction.guild.id
         self.loop = bot.loop
         self.queue = SongQueue()
         self._next = asyncio.Event() #syncs player and player window
         
         self._run_player_task = None
         self._run_lock = asyncio.Lock()
+        self._lookahead_task = None
+        self._ingest_task = None
+        self._ingest_pending = deque()
 
         self._player = None
         self._player_window = None
@@ -47,6 +57,14 @@ class PlayerContext():
 
         self.lava_enabled = lava_enabled
         self.lava_node = lava_node
+        self.track_cache = track_cache
+        self._resolver = resolver #async (context, query) -> source, resolves stubs from streamed in playlists and hibernated records
+
+        self.last_active = time.monotonic()
+        self._restore_volume = None
+        self._restore_loop = False
+        self.restoring = None #task reading this guilds snapshot, play waits on it so the restored queue goes first
+        self.audio_requested = None #perf_counter of the /play waiting on first audio, set by the music cog
 
     @property
     def player(self):
@@ -58,26 +76,189 @@ class PlayerContext():
 
     async def skip(self):
         if self.current:
+            self._cancel_lookahead() #_run starts it again once the next song is pulled
             self.current = None
             await self._player.skip()
             
     async def stop(self): 
+        self._cancel_lookahead()
+        if self._ingest_task:
+            self._ingest_task.cancel()
+            self._ingest_task = None
+        self._ingest_pending.clear()
         self.current = None
+        for song in self.queue:
+            song.cleanup()
         self.queue.clear()
         await self._player.stop()
 
-    async def play(self, source):
-        if isinstance(source, list):
-            for track_source in source:
-                song = Song(LavaSourceAdapter(track_source) if self.lava_enabled else YTDLSourceAdapter(track_source))
-                await self.queue.put(song)
-        else:
-            song = Song(LavaSourceAdapter(source) if self.lava_enabled else YTDLSourceAdapter(source))
-            await self.queue.put(song)
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_idle(self, timeout):
+        if time.monotonic() - self.last_active < timeout:
+            return False
+        #a loop that ended or timed out, or one sat on a track thats been paused since nobody came back to
+        running = self._run_player_task and not self._run_player_task.done()
+        return not running or (self._player is not None and self._player.state == PlayerState.PAUSED)
+
+    async def hibernate(self):
+        self._cancel_lookahead()
+        if self._ingest_task:
+            self._ingest_task.cancel()
+            self._ingest_task = None
+
+        #a paused track goes back to the front of the queue and restarts from the top once restored
+        tracks = [(self.current.reference, self.current.title)] if self.current else []
+        tracks.extend((item.reference, item.title) for item in self.queue)
+        for pending, _ in self._ingest_pending:
+            tracks.extend(pending)
+        self._ingest_pending.clear()
+
+        volume = self._player.volume_level if self._player else self._restore_volume
+        record = HibernatedContext([track for track in tracks if track[0]], volume, bool(self.current_loop) or self._restore_loop)
+
+        if self._run_player_task and not self._run_player_task.done():
+            self._run_player_task.cancel()
+            try: #same teardown as a timed out loop, leaves the voice channel
+                await self._player.stale()
+                await self._player_window.stale()
+                if self.lava_enabled:
+                    await self._player.voice.destroy()
+            except Exception as e:
+                print(f"Failed to tear down paused player for guild {self.guild_id}: {repr(e)}")
+
+        if self.current:
+            self.current.cleanup()
+            self.current = None
+        for item in self.queue:
+            item.cleanup()
+        self.queue.clear()
+
+        return record
+
+    def snapshot(self):
+        tracks = [(self.current.reference, self.current.title)] if self.current else []
+        tracks.extend((item.reference, item.title) for item in self.queue)
+
+        volume = self._player.volume_level if self._player else self._restore_volume
+        return HibernatedContext([track for track in tracks if track[0]], volume, bool(self.current_loop) or self._restore_loop)
+
+    def snapshot_signature(self):
+        #cheap stand in for "did anything worth saving change", avoids walking the queue every interval
+        volume = self._player.volume_level if self._player else self._restore_volume
+        return (self.queue.version, self.current.id if self.current else None, bool(self.current_loop), volume)
+
+    def restore(self, record):
+        self.queue.extend(SongStub(reference=reference, title=title) for reference, title in record.tracks)
+        self._restore_volume = record.volume
+        self._restore_loop = record.loop
+
+    def shuffle(self):
+        self._cancel_lookahead()
+        self.queue.shuffle()
+        self._schedule_lookahead()
+
+    async def play(self, source, requester=None):
+        sources = source if isinstance(source, list) else [source]
+        if not sources:
+            return
 
-        if not self._run_player_task:
+        if self.restoring:
+            await self.restoring
+            self.restoring = None
+
+        #only the first track becomes a full song, the rest are kept as (reference, title) and stream in as stubs
+        #so playback starts right away and a big playlist doesnt keep every full track object alive
+        if self._ingest_task: #stays behind a playlist thats still streaming in
+            self._ingest_pending.append((self._references(sources), requester))
+        else:
+            await self.queue.put(self._song(sources[0], requester))
+            if len(sources) > 1:
+                self._ingest_pending.append((self._references(sources[1:]), requester))
+                self._ingest_task = self.loop.create_task(self._ingest())
+
+        if not self._run_player_task or self._run_player_task.done(): #a finished loop gets replaced, not waited on
+            if self._restore_volume is not None:
+                await self._player.volume(self._restore_volume)
+                self._restore_volume = None
             self._player.state = PlayerState.WAITING
             self._run_player_task = self.loop.create_task(self._run())
+        elif not self._lookahead_task:
+            self._schedule_lookahead()
+
+    def _song(self, source, requester=None):
+        return Song(LavaSourceAdapter(source) if self.lava_enabled else YTDLSourceAdapter(source), requester)
+
+    @staticmethod
+    def _references(sources):
+        return [(reference, source.title) for source in sources if (reference := track_reference(source))]
+
+    async def _materialize(self, item):
+        if not isinstance(item, SongStub):
+            return item
+
+        #stubs only keep the reference, the track gets resolved again once it nears the head of the queue
+        if not self._resolver:
+            return None
+        try:
+            source = await self._resolver(self, item.reference)
+        except Exception as e: #deleted videos and expired lavalink ids are normal, for old snapshots especially, drop the stub and move on
+            print(f"Failed to resolve {item.reference}: {repr(e)}")
+            return None
+        if isinstance(source, list):
+            source = source[0] if source else None
+            if source is None:
+                return None
+
+        song = self._song(source, item.requester)
+        song.id = item.id
+        song.queued_at = item.queued_at
+        return song
+
+    async def _ingest(self):
+        while self._ingest_pending:
+            references, requester = self._ingest_pending.popleft()
+            for start in range(0, len(references), PlayerContext.INGEST_CHUNK):
+                self.queue.extend(SongStub(reference, title, requester) for reference, title in references[start:start+PlayerContext.INGEST_CHUNK])
+                if self._run_player_task and not self._lookahead_task:
+                    self._schedule_lookahead()
+                await asyncio.sleep(0)
+        self._ingest_task = None
+
+    def _schedule_lookahead(self):
+        self._cancel_lookahead()
+        if PlayerContext.LOOKAHEAD > 0 and not self.queue.empty():
+            self._lookahead_task = self.loop.create_task(self._lookahead())
+
+    def _cancel_lookahead(self):
+        if self._lookahead_task and not self._lookahead_task.done():
+            self._lookahead_task.cancel()
+        self._lookahead_task = None
+
+    async def _lookahead(self):
+        for item in self.queue[:PlayerContext.LOOKAHEAD]:
+            if item.id not in self.queue: #removed while an earlier song was being prepared
+                continue
+
+            song = await self._materialize(item)
+            if item.id not in self.queue: #pulled or removed while it was being resolved
+                continue
+            if song is None:
+                self.queue.remove_id(item.id)
+                continue
+            if song is not item:
+                self.queue.replace(item.id, song)
+            await self._prepare(song)
+        self._lookahead_task = None
+
+    async def _prepare(self, song):
+        try:
+            await song.track.prepare(self.loop, self.track_cache)
+        except Exception as e: #any extractor error, the song gets skipped rather than taking the player loop down
+            print(f"Failed to refresh {song.track.title}: {repr(e)}")
+            return False
+        return True
 
     def _playback_finished(self, error=None):
 
@@ -92,12 +273,25 @@ class PlayerContext():
         async with self._run_lock:
             while 1:
                 song = self.current_loop
+                if song and not await self._prepare(song):
+                    self.current_loop = song = None #stream cant be refreshed, stop looping it
                 if not song:
-                    song = None if self.queue.empty() else await self.queue.get()
-                    
+                    while not song and not self.queue.empty():
+                        song = await self._materialize(await self.queue.get())
+                        if song and not await self._prepare(song): #no-op if lookahead already got to it
+                            song.cleanup()
+                            song = None
+                    if song:
+                        metrics.observe("queue_wait", time.monotonic() - song.queued_at, self.guild_id)
+                    self._schedule_lookahead()
+                    if song and self._restore_loop:
+                        self.current_loop = song
+                        self._restore_loop = False
+
                 self.current = song
+                self.touch()
 
-                self.loop.create_task(self._player.play_track(song, self._playback_finished if not self.lava_enabled else None))
+                self.loop.create_task(self._start_track(song))
                 self.loop.create_task(self._player_window.player_window(song, 0))
                 try:
                     if song:
@@ -106,6 +300,7 @@ class PlayerContext():
                         await asyncio.wait_for(self.queue.item_available(), PlayerContext.TIMEOUT)
                 except asyncio.TimeoutError:
                     print("playercontext timeout")
+                    metrics.inc("run_timeouts", self.guild_id)
                     await self._player.stale()
                     await self._player_window.stale()
                     if self.lava_enabled:
@@ -120,6 +315,12 @@ class PlayerContext():
                     self._next.clear()
 
 
+    async def _start_track(self, song):
+        await self._player.play_track(song, self._playback_finished if not self.lava_enabled else None)
+        if song and self.audio_requested is not None:
+            metrics.observe("play_to_audio", time.perf_counter() - self.audio_requested, self.guild_id)
+            self.audio_requested = None
+
     @property
     def is_playing(self):
         if self._player:
@@ -135,12 +336,31 @@ class PlayerContext():
         self._player_window = PlayerWindow(self._bot, self._inter.channel, self._inter.author)
 
 class Song:
-    __slots__ = ('track') #more mem efficent and faster than __dict__
+    __slots__ = ('track', 'requester', 'id', 'queued_at', '_embed') #more mem efficent and faster than __dict__
+    _empty_embed = None
 
-    def __init__(self, track):
+    def __init__(self, track, requester=None):
         self.track = track
+        self.requester = requester
+        self.id = None #assigned by SongQueue
+        self.queued_at = time.monotonic()
+        self._embed = self._build_embed() #built once when queued, every window refresh and /playing reuses it
+
+    @property
+    def title(self):
+        return self.track.title
+
+    @property
+    def reference(self):
+        return track_reference(self.track.source)
+
+    def cleanup(self):
+        self.track.cleanup()
 
     def create_embed(self):
+        return self._embed
+
+    def _build_embed(self):
         return (disnake.Embed(title='```{0.track.title}\n```'.format(self), color=disnake.Color.blurple())
         .set_image(url=self.track.thumbnail)
         #.add_field(name='Requested by', value=self.requester.mention)
@@ -151,9 +371,31 @@ class Song:
     
     @staticmethod
     def create_empty_embed():
-        return (disnake.Embed(title='```No Current Songs In Queue\n```', color=disnake.Color.blurple())
-        .set_image(url='https://www.clipartmax.com/png/middle/307-3076576_song-clipart-music-bar-paper.png')
-        .set_author(name="Now playing"))
+        if Song._empty_embed is None: #same for every guild, so only one ever gets made
+            Song._empty_embed = (disnake.Embed(title='```No Current Songs In Queue\n```', color=disnake.Color.blurple())
+            .set_image(url='https://www.clipartmax.com/png/middle/307-3076576_song-clipart-music-bar-paper.png')
+            .set_author(name="Now playing"))
+        return Song._empty_embed
+def track_reference(source):
+    return getattr(source, 'uri', None) or getattr(source, 'url', None) #lavalink track uri or ytdl webpage url
+
+class SongStub:
+    __slots__ = ('requester', 'id', 'reference', 'queued_at', '_title') #stands in for a queued track until it nears the head of the queue
+
+    def __init__(self, reference, title=None, requester=None):
+        self.requester = requester
+        self.id = None
+        self.queued_at = time.monotonic()
+        self.reference = reference
+        self._title = title
+
+    @property
+    def title(self):
+        return self._title or self.reference
+
+    def cleanup(self):
+        pass #holds no audio source
+
 class BaseSourceAdapter(ABC):
     
     @property
@@ -176,10 +418,27 @@ class BaseSourceAdapter(ABC):
     def title(self):
         ...
 
+    async def prepare(self, loop, cache=None):
+        pass
+
+    def cleanup(self):
+        pass
+
 class YTDLSourceAdapter(BaseSourceAdapter):
     def __init__(self, source):
         self.source = source
 
+    async def prepare(self, loop, cache=None):
+        if not self.source.is_expiring():
+            return
+
+        source = await self.source.refresh(loop=loop, cache=cache) #reopens ffmpeg on a fresh stream url
+        self.source.cleanup()
+        self.source = source
+
+    def cleanup(self):
+        self.source.cleanup()
+
     @property
     def thumbnail(self):
         return self.source.thumbnail
@@ -203,7 +462,7 @@ class LavaSourceAdapter(BaseSourceAdapter):
     def _toSeconds(self, ms):
         return int(ms/1000)
 
-    @property
+    @cached_property
     def thumbnail(self):
         resized = None
 
@@ -213,11 +472,11 @@ class LavaSourceAdapter(BaseSourceAdapter):
 
         return resized if resized else self.source.thumbnail
 
-    @property
+    @cached_property
     def length(self):
         return YTDLSource.parse_duration(self._toSeconds(self.source.length))
     
-    @property
+    @cached_property
     def raw_duration(self):
         return self._toSeconds(self.source.length)
     
@@ -226,39 +485,11 @@ class LavaSourceAdapter(BaseSourceAdapter):
         return self.source.title
 
         
-class SongQueue(asyncio.Queue):
-    def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
-        else:
-            return self._queue[item]
-
-    def __iter__(self):
-        return self._queue.__iter__()
-
-    def __len__(self):
-        return self.qsize()
-
-    def clear(self):
-        self._queue.clear()
-
-    def shuffle(self):
-        random.shuffle(self._queue)
-
-    def remove(self, index: int):
-        del self._queue[index]
-
-    async def item_available(self):
-        while 1:
-            if not self.empty():
-                return True
-
-            await asyncio.sleep(.5) #try not to waste cpu cycles
-
 class BasePlayer(ABC):
     def __init__(self) -> None:
         self.state = PlayerState.STOPPED
         self.current = None
+        self.volume_level = None #last volume set through /volume, None if never changed
     
     async def stale(self):
         self.state = PlayerState.STALE
@@ -288,6 +519,7 @@ class BasePlayer(ABC):
         await await_me_maybe(self._seek, pos=pos)
 
     async def volume(self, value):
+        self.volume_level = value
         await await_me_maybe(self._volume, value=value)
 
     async def play_track(self, track, callback=None):
@@ -419,6 +651,12 @@ class LavaPlayer(BasicPlayer):
         self.state = PlayerState.PLAYING
 
 class PlayerWindow():
+    EDIT_RATE = 5 #discord allows about 5 message edits per 5 seconds in a channel
+    EDIT_PER = 5.0
+    DRAW_COST = 2 #a redraw edits the embed, then the menu edits the message again to refresh its buttons
+    STALE_COST = 2 #deleting the window and stopping its menu
+    updates = CoalescingScheduler(EDIT_RATE, EDIT_PER) #shared, keyed by channel
+
     def __init__(self, bot, channel, author):
         self.bot = bot
         self.loop = bot.loop
@@ -430,14 +668,28 @@ class PlayerWindow():
     
     async def stale(self):
         self.state = PlayerWindowState.STALE
-        await self._current_window.delete()
-        await self._menu.stop()
-        self._menu = None
+        PlayerWindow.updates.cancel(self.channel.id)
+        if self._current_window or self._menu:
+            PlayerWindow.updates.charge(self.channel.id, PlayerWindow.STALE_COST) #a new window in this channel waits for these too
+        if self._current_window: #a window that never got drawn has nothing to clean up
+            await self._current_window.delete()
+            self._current_window = None
+        if self._menu:
+            await self._menu.stop()
+            self._menu = None
 
     async def player_window(self, song, timeout):
         if self.state == PlayerWindowState.STALE:
             return  
 
+        #only the newest window state gets drawn, rapid skips dont turn into a burst of edits
+        submitted = time.perf_counter()
+        PlayerWindow.updates.submit(self.channel.id, lambda : self._draw(song, timeout, submitted), PlayerWindow.DRAW_COST)
+
+    async def _draw(self, song, timeout, submitted=None):
+        if self.state == PlayerWindowState.STALE:
+            return  
+
         create_player_embed = lambda current : current.create_embed() if current else Song.create_empty_embed()
         self.state = PlayerWindowState.ACTIVE
 
@@ -451,4 +703,7 @@ class PlayerWindow():
         else:
             await self._current_window.edit(embed=create_player_embed(song))
             self._menu.disable_all_buttons() if not song else self._menu.enable_all_buttons()
-            await self._menu.restart(song.track.raw_duration+timeout if song else timeout)
\ No newline at end of file
+            await self._menu.restart(song.track.raw_duration+timeout if song else timeout)
+
+        if submitted is not None: #includes time spent waiting out the channel edit rate limit
+            metrics.observe("window_update", time.perf_counter() - submitted, self.channel.guild.id)
\ No newline at end of file
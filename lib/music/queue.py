@@ -0,0 +1,323 @@
+from collections import defaultdict
+import asyncio
+import random
+import itertools
+
+#list split into chunks with a fenwick tree over chunk sizes, positional ops are O(log n) plus a small memmove
+class IndexedList():
+    LOAD = 512
+
+    def __init__(self, items=(), key=id):
+        self._key = key
+        self._rebuild(list(items))
+
+    def _rebuild(self, items):
+        load = IndexedList.LOAD
+        self._chunks = [items[i:i+load] for i in range(0, len(items), load)]
+        self._len = len(items)
+        self._home = {self._key(item): chunk for chunk in self._chunks for item in chunk}
+        self._reindex()
+
+    def _reindex(self):
+        tree = [0] + [len(chunk) for chunk in self._chunks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+
+        self._tree = tree
+        self._chunk_pos = {id(chunk): i for i, chunk in enumerate(self._chunks)}
+
+    def _update(self, chunk_idx, delta):
+        i = chunk_idx + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, chunk_idx):
+        total = 0
+        while chunk_idx > 0:
+            total += self._tree[chunk_idx]
+            chunk_idx -= chunk_idx & -chunk_idx
+        return total
+
+    def _locate(self, index):
+        pos, rem = 0, index
+        bit = 1 << (len(self._tree) - 1).bit_length()
+        while bit:
+            nxt = pos + bit
+            if nxt < len(self._tree) and self._tree[nxt] <= rem:
+                pos = nxt
+                rem -= self._tree[nxt]
+            bit >>= 1
+        return pos, rem
+
+    def _normalize(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        return index
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __getitem__(self, index):
+        chunk_idx, offset = self._locate(self._normalize(index))
+        return self._chunks[chunk_idx][offset]
+
+    def __contains__(self, item):
+        return self._key(item) in self._home
+
+    def slice(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self._len)
+        if start >= stop:
+            return []
+
+        chunk_idx, offset = self._locate(start)
+        items = []
+        while len(items) < stop - start:
+            chunk = self._chunks[chunk_idx]
+            items.extend(chunk[offset:offset + stop - start - len(items)])
+            chunk_idx, offset = chunk_idx + 1, 0
+        return items
+
+    def index(self, item):
+        chunk = self._home[self._key(item)]
+        return self._prefix(self._chunk_pos[id(chunk)]) + chunk.index(item)
+
+    def append(self, item):
+        self.insert(self._len, item)
+
+    def insert(self, index, item):
+        index = max(0, min(index + self._len if index < 0 else index, self._len))
+
+        if not self._chunks:
+            self._chunks.append([])
+            self._reindex()
+
+        if index == self._len:
+            chunk_idx, offset = len(self._chunks) - 1, len(self._chunks[-1])
+        else:
+            chunk_idx, offset = self._locate(index)
+
+        chunk = self._chunks[chunk_idx]
+        chunk.insert(offset, item)
+        self._home[self._key(item)] = chunk
+        self._len += 1
+
+        if len(chunk) > IndexedList.LOAD*2:
+            half = chunk[IndexedList.LOAD:]
+            del chunk[IndexedList.LOAD:]
+            self._chunks.insert(chunk_idx + 1, half)
+            for moved in half:
+                self._home[self._key(moved)] = half
+            self._reindex()
+        else:
+            self._update(chunk_idx, 1)
+
+    def pop(self, index=-1):
+        chunk_idx, offset = (0, 0) if index == 0 and self._len else self._locate(self._normalize(index))
+        chunk = self._chunks[chunk_idx]
+        item = chunk.pop(offset)
+        del self._home[self._key(item)]
+        self._len -= 1
+
+        if not chunk:
+            del self._chunks[chunk_idx]
+            self._reindex()
+        else:
+            self._update(chunk_idx, -1)
+
+        return item
+
+    def popleft(self):
+        return self.pop(0)
+
+    def clear(self):
+        self._rebuild([])
+
+    def shuffle(self):
+        items = list(self)
+        random.shuffle(items)
+        self._rebuild(items)
+
+class SongQueue(asyncio.Queue):
+    PAGE_SIZE = 10
+
+    def _init(self, maxsize):
+        self._queue = IndexedList(key=lambda item : item.id)
+        self._ids = itertools.count(1)
+        self._by_id = {}
+        self._by_title = defaultdict(set)
+        self._by_requester = defaultdict(set)
+        self._waiters = [] #futures from item_available, resolved by _put instead of polling
+        self.version = 0 #bumped by every mutation, lets callers tell the queue changed without walking it
+
+    def _put(self, item):
+        self._register(item)
+        self._queue.append(item)
+        self.version += 1
+        self._notify()
+
+    def _get(self):
+        item = self._queue.popleft()
+        self._unregister(item)
+        self.version += 1
+        return item
+
+    def _notify(self):
+        while self._waiters:
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                waiter.set_result(True)
+
+    @staticmethod
+    def _title_key(title):
+        return " ".join(str(title).lower().split())
+
+    @staticmethod
+    def _requester_key(requester):
+        return getattr(requester, "id", requester)
+
+    def _register(self, item):
+        if getattr(item, "id", None) is None: #keeps its id when moved or put back
+            item.id = next(self._ids)
+
+        self._by_id[item.id] = item
+        self._by_title[self._title_key(item.title)].add(item.id)
+        if item.requester is not None:
+            self._by_requester[self._requester_key(item.requester)].add(item.id)
+
+    def _unregister(self, item):
+        del self._by_id[item.id]
+        self._discard(self._by_title, self._title_key(item.title), item.id)
+        if item.requester is not None:
+            self._discard(self._by_requester, self._requester_key(item.requester), item.id)
+
+    @staticmethod
+    def _discard(index, key, item_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del index[key]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            items = self._queue.slice(item.start, item.stop)
+            return items[::item.step] if item.step else items
+        else:
+            return self._queue[item]
+
+    def __iter__(self):
+        return self._queue.__iter__()
+
+    def __len__(self):
+        return self.qsize()
+
+    def __contains__(self, track_id):
+        return track_id in self._by_id
+
+    def clear(self):
+        self._queue.clear()
+        self._by_id.clear()
+        self._by_title.clear()
+        self._by_requester.clear()
+        self.version += 1
+
+    def shuffle(self):
+        self._queue.shuffle()
+        self.version += 1
+
+    def remove(self, index: int):
+        item = self._queue.pop(index)
+        self._unregister(item)
+        self.version += 1
+        return item
+
+    def remove_id(self, track_id):
+        return self.remove(self.index(track_id))
+
+    def insert(self, index: int, item):
+        if self.full():
+            raise asyncio.QueueFull
+
+        self._register(item)
+        self._queue.insert(index, item)
+        self.version += 1
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+        self._notify()
+
+    def extend(self, items):
+        if self.full():
+            raise asyncio.QueueFull
+
+        count = 0
+        for item in items: #one wakeup for the whole batch instead of a put per item
+            self._register(item)
+            self._queue.append(item)
+            count += 1
+
+        self.version += 1
+        self._unfinished_tasks += count
+        self._finished.clear()
+        for _ in range(min(count, len(self._getters))):
+            self._wakeup_next(self._getters)
+        self._notify()
+
+    def move(self, index: int, to: int):
+        item = self._queue.pop(index)
+        self._queue.insert(to, item)
+        self.version += 1
+        return item
+
+    def replace(self, track_id, item):
+        index = self.index(track_id)
+        old = self.remove(index)
+        item.id = old.id
+        self._register(item)
+        self._queue.insert(index, item)
+        self.version += 1
+        return old
+
+    def index(self, track_id):
+        if track_id not in self._by_id:
+            raise KeyError(track_id)
+        return self._queue.index(self._by_id[track_id])
+
+    def lookup(self, track_id):
+        return self._by_id.get(track_id)
+
+    def find(self, title=None, requester=None):
+        ids = None
+        if title is not None:
+            ids = set(self._by_title.get(self._title_key(title), ()))
+        if requester is not None:
+            by_requester = self._by_requester.get(self._requester_key(requester), set())
+            ids = by_requester.copy() if ids is None else ids & by_requester
+
+        return sorted((self._by_id[track_id] for track_id in ids or ()), key=lambda item : item.id)
+
+    def page(self, number: int, size: int = PAGE_SIZE):
+        pages = max(1, -(-len(self) // size))
+        number = max(1, min(number, pages))
+        start = (number - 1)*size
+        return self._queue.slice(start, start + size), number, pages
+
+    async def item_available(self):
+        while self.empty():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters: #cancelled by wait_for, dont keep it around
+                    self._waiters.remove(waiter)
+
+        return True
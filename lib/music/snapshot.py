@@ -0,0 +1,60 @@
+import threading
+import sqlite3
+import json
+import time
+
+class HibernatedContext:
+    __slots__ = ('tracks', 'volume', 'loop') #what an evicted or snapshotted PlayerContext keeps, (reference, title) per queued track
+
+    def __init__(self, tracks, volume=None, loop=False):
+        self.tracks = tracks
+        self.volume = volume
+        self.loop = loop
+
+    def __bool__(self):
+        return bool(self.tracks) or self.volume is not None or self.loop
+
+    def to_json(self):
+        return json.dumps({"t": self.tracks, "v": self.volume, "l": self.loop}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls([tuple(track) for track in data["t"]], data["v"], data["l"])
+
+#per guild queue snapshots, so a restart doesnt lose everyones queue
+#every cluster under launcher.py shares the file, each one only reads and writes the guilds its shards own
+class SnapshotStore():
+    BUSY_TIMEOUT = 5 #seconds to wait on another clusters commit before a save fails and gets retried next interval
+
+    def __init__(self, path="lib/bot/snapshots.db"):
+        self._db = sqlite3.connect(path, timeout=SnapshotStore.BUSY_TIMEOUT, check_same_thread=False) #writes happen on an executor thread
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL") #one clusters save doesnt block the others reads
+            self._db.execute("CREATE TABLE IF NOT EXISTS snapshots (guild_id INTEGER PRIMARY KEY, payload TEXT NOT NULL, updated REAL NOT NULL)")
+            self._db.commit()
+
+    def guild_ids(self, owned=None):
+        with self._lock:
+            guild_ids = {row[0] for row in self._db.execute("SELECT guild_id FROM snapshots")}
+        return {guild_id for guild_id in guild_ids if owned(guild_id)} if owned else guild_ids
+
+    def load(self, guild_id):
+        with self._lock:
+            row = self._db.execute("SELECT payload FROM snapshots WHERE guild_id = ?", (guild_id,)).fetchone()
+        return HibernatedContext.from_json(row[0]) if row else None
+
+    def save_many(self, records):
+        now = time.time()
+        keep = [(guild_id, record.to_json(), now) for guild_id, record in records.items() if record]
+        drop = [(guild_id,) for guild_id, record in records.items() if not record]
+
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO snapshots (guild_id, payload, updated) VALUES (?, ?, ?)", keep)
+            self._db.executemany("DELETE FROM snapshots WHERE guild_id = ?", drop)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
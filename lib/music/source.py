@@ -3,6 +3,9 @@ import disnake
 import youtube_dl
 import asyncio
 import functools
+from lib.util.asynctools import BoundedExecutor
+from lib.music.cache import TrackCache
+import time
 
 
 youtube_dl.utils.bug_reports_message = lambda: ''
@@ -16,6 +19,7 @@ class YTDLSource(disnake.PCMVolumeTransformer):
         'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
         'restrictfilenames': True,
         'noplaylist': True,
+        'playlistend': 1, #only the first hit gets used, dont process the rest of a search or list
         'nocheckcertificate': True,
         'ignoreerrors': False,
         'logtostderr': False,
@@ -31,9 +35,17 @@ class YTDLSource(disnake.PCMVolumeTransformer):
     }   
     ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
 
+    RESOLVER_WORKERS = 4
+    resolver = BoundedExecutor(RESOLVER_WORKERS, name="ytdl")
+
+    #only what __init__ reads, the full info blob is huge and gets cached to disk
+    info_keys = ('uploader', 'uploader_url', 'upload_date', 'title', 'thumbnail', 'description', 'duration',
+        'tags', 'webpage_url', 'view_count', 'like_count', 'dislike_count', 'url')
+
     def __init__(self, ctx:commands.Context, source: disnake.FFmpegPCMAudio, *, data: dict, volume=0.5):
         super().__init__(source, volume)
 
+        self.ctx = ctx
         self.requester = ctx.author
         self.channel = ctx.channel
         self.data = data
@@ -53,48 +65,60 @@ class YTDLSource(disnake.PCMVolumeTransformer):
         self.likes = data.get('like_count')
         self.dislikes = data.get('dislike_count')
         self.stream_url = data.get('url')
+        self.expires_at = TrackCache.stream_expiry(self.stream_url)
+
+    def is_expiring(self, margin=TrackCache.STREAM_MARGIN):
+        return self.expires_at is not None and self.expires_at - margin <= time.time()
+
+    async def refresh(self, *, loop: asyncio.BaseEventLoop = None, cache=None):
+        source = await YTDLSource.create_source(self.ctx, self.url, loop=loop, cache=cache)
+        source.volume = self.volume
+        return source
 
 
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
+    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None, cache=None):
         loop = loop or asyncio.get_event_loop()
 
-        partial = functools.partial(cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
+        info = await cache.get("ytdl", search) if cache else None
+        if info is None:
+            info = await cls._extract(search, loop)
+            if cache:
+                cache.put("ytdl", [search, info.get('webpage_url')], info, ttl=cache.stream_ttl(info.get('url')))
+
+        return cls(ctx, disnake.FFmpegPCMAudio(info['url'], **cls.ffmpeg_options), data=info)
+
+    @classmethod
+    def configure_resolver(cls, workers):
+        if workers == cls.resolver.max_workers:
+            return
+        old, cls.resolver = cls.resolver, BoundedExecutor(workers, name="ytdl")
+        old.shutdown()
+
+    @classmethod
+    async def _extract(cls, search, loop):
+        partial = functools.partial(cls.ytdl.extract_info, search, download=False)
+        data = await cls.resolver.run(partial, loop=loop) #search hits and direct urls both come back processed in one call
 
         if data is None:
             raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
 
-        if 'entries' not in data:
-            process_info = data
-        else:
-            process_info = None
-            for entry in data['entries']:
-                if entry:
-                    process_info = entry
-                    break
+        info = data
+        if 'entries' in data:
+            info = next((entry for entry in data['entries'] if entry), None)
 
-            if process_info is None:
+            if info is None:
                 raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
 
-        webpage_url = process_info['webpage_url']
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
-
-        if processed_info is None:
-            raise YTDLError('Couldn\'t fetch `{}`'.format(webpage_url))
+        if info.get('_type') == 'url': #unresolved entry, only happens for some extractors
+            webpage_url = info.get('webpage_url') or info['url']
+            partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
+            info = await cls.resolver.run(partial, loop=loop)
 
-        if 'entries' not in processed_info:
-            info = processed_info
-        else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info['entries'].pop(0)
-                except IndexError:
-                    raise YTDLError('Couldn\'t retrieve any matches for `{}`'.format(webpage_url))
+            if info is None:
+                raise YTDLError('Couldn\'t fetch `{}`'.format(webpage_url))
 
-        return cls(ctx, disnake.FFmpegPCMAudio(info['url'], **cls.ffmpeg_options), data=info)
+        return {key: info.get(key) for key in cls.info_keys}
 
     @staticmethod
     def parse_duration(duration: int):
@@ -0,0 +1,108 @@
+from collections import Counter, defaultdict
+import asyncio
+import math
+import json
+import os
+import csv
+import re
+
+#naive bayes over word unigrams and bigrams, answers obvious messages in microseconds
+class NgramClassifier():
+    TOKEN = re.compile(r"[a-z0-9']+")
+
+    def __init__(self, classes=(), priors=None, counts=None, totals=None, vocab_size=0, alpha=1.0):
+        self.classes = list(classes)
+        self.priors = priors or {}
+        self.counts = counts or {}
+        self.totals = totals or {}
+        self.vocab_size = vocab_size
+        self.alpha = alpha
+
+    @classmethod
+    def features(cls, text):
+        words = cls.TOKEN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    @classmethod
+    def fit(cls, texts, labels, alpha=1.0):
+        docs = Counter(labels)
+        counts = defaultdict(Counter)
+        for text, label in zip(texts, labels):
+            counts[label].update(cls.features(text))
+
+        vocab = set()
+        for features in counts.values():
+            vocab.update(features)
+
+        return cls(
+            classes=sorted(docs),
+            priors={label: math.log(n/len(labels)) for label, n in docs.items()},
+            counts={label: dict(features) for label, features in counts.items()},
+            totals={label: sum(features.values()) for label, features in counts.items()},
+            vocab_size=len(vocab),
+            alpha=alpha,
+        )
+
+    @classmethod
+    def fit_csv(cls, *paths, alpha=1.0):
+        texts, labels = [], []
+        for path in paths:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    texts.append(row["text"])
+                    labels.append(row["intent"])
+        return cls.fit(texts, labels, alpha)
+
+    def predict(self, text):
+        features = self.features(text)
+        scores = {}
+        for label in self.classes:
+            counts = self.counts.get(label, {})
+            denominator = math.log(self.totals.get(label, 0) + self.alpha*(self.vocab_size + 1))
+            scores[label] = self.priors[label] + sum(math.log(counts.get(feature, 0) + self.alpha) - denominator for feature in features)
+
+        best = max(scores, key=scores.get)
+        #softmax of the best class, shifted by its score so exp never overflows
+        confidence = 1/sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, confidence
+
+    def save(self, path):
+        #written next to the target and swapped in, clusters fitting at the same time never load a half written file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "classes": self.classes,
+                "priors": self.priors,
+                "counts": self.counts,
+                "totals": self.totals,
+                "vocab_size": self.vocab_size,
+                "alpha": self.alpha,
+            }, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+#tries each (classifier, threshold) tier in order, anything none of them are sure about goes to the fallback
+class IntentCascade():
+    def __init__(self, tiers, fallback):
+        self.tiers = tiers
+        self.fallback = fallback #async callable, normally MicroBatcher.submit in front of bert
+        self.answered = Counter()
+
+    async def classify(self, text):
+        for n, (classifier, threshold) in enumerate(self.tiers):
+            label, confidence = classifier.predict(text)
+            if confidence >= threshold:
+                self.answered[n] += 1
+                return label
+
+        self.answered["fallback"] += 1
+        label = self.fallback(text)
+        return await label if asyncio.iscoroutine(label) else label
+
+    def stats(self):
+        total = sum(self.answered.values())
+        return {str(tier): count/total for tier, count in self.answered.items()} if total else {}
@@ -0,0 +1,88 @@
+from collections import OrderedDict, deque
+import threading
+import time
+
+MISS = object()
+
+#pulls the search query out of "play X by Y" style messages, patterns are compiled once and results memoized
+class QueryExtractor():
+    CACHE_SIZE = 1024
+    PATTERNS = [[{"POS": "VERB"},{"OP": "?"}, {"OP": "?"},{"OP": "?"}, {"LOWER": "by"},{"OP": "?"},  {"OP": "?"}],
+        [{"POS": "VERB"},{"OP": "?"}, {"OP": "?"},{"OP": "?"}]
+    ]
+
+    def __init__(self, nlp, matcher_cls, cache_size=CACHE_SIZE):
+        self.nlp = nlp
+        self.matcher = matcher_cls(nlp.vocab)
+        self.matcher.add("songbypattern", QueryExtractor.PATTERNS)
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock() #guards the cache, extract runs on the parse thread and lookup on the loop
+
+        self.hits = 0
+        self.misses = 0
+        self._times = deque(maxlen=256)
+
+    def lookup(self, content):
+        #keyed on the exact message, the tagger and the returned query both depend on casing and spacing
+        start = time.perf_counter()
+
+        with self._lock:
+            if content not in self._cache:
+                return MISS
+            self._cache.move_to_end(content)
+            self.hits += 1
+            query = self._cache[content]
+
+        self._times.append(time.perf_counter() - start)
+        return query
+
+    def extract(self, content):
+        start = time.perf_counter()
+        query = self._extract(content)
+
+        with self._lock:
+            self.misses += 1
+            self._cache[content] = query
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        self._times.append(time.perf_counter() - start)
+        return query
+
+    def _extract(self, content):
+        doc = self.nlp(content)
+        matches = self.matcher(doc)
+        #for letter, token in zip(content.split(" "), doc):
+        #    print(f"{letter}:{token.pos_}-{token.ent_type_}")
+        if len(matches) == 0:
+            return None
+
+        diff = [ match[-1] - match[-2] for match in matches ]
+        idx = diff.index(max(diff)) #finds biggest match
+        _, start, end = matches[idx]
+        span = doc[start:end]
+
+        cmd = " ".join(span.text.split(" ")[1:]) #just removes the verb, like "play" from the search query
+        
+        for word, token in zip(content.split(" "), doc):
+
+            if token.pos_ == "VERB" and word in cmd:
+                cmd = cmd.replace(word, "")[1:]
+                break
+
+        return cmd
+
+    def stats(self):
+        times = sorted(self._times)
+        total = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits/total if total else 0.0,
+            "entries": len(self._cache),
+            "p50": times[len(times)//2] if times else 0.0,
+            "max": times[-1] if times else 0.0,
+        }
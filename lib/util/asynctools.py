@@ -1,4 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
 import asyncio 
+import time
 
 async def await_me_maybe(func, **kwargs):
     if callable(func):
@@ -6,3 +10,203 @@ async def await_me_maybe(func, **kwargs):
     if asyncio.iscoroutine(value):
         value = await value
     return value
+
+#thread pool with its own queue, so blocking work doesnt wait behind the loops default executor
+class BoundedExecutor():
+    SAMPLES = 256
+
+    def __init__(self, max_workers, name="pool"):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+        self.pending = 0 #submitted but not picked up by a worker yet
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self._waits = deque(maxlen=BoundedExecutor.SAMPLES)
+        self._runs = deque(maxlen=BoundedExecutor.SAMPLES)
+
+    def _call(self, submitted, func, args):
+        started = time.perf_counter()
+        with self._lock:
+            self.pending -= 1
+            self.active += 1
+        self._waits.append(started - submitted)
+
+        try:
+            return func(*args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            self._runs.append(time.perf_counter() - started)
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def run(self, func, *args, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        with self._lock:
+            self.pending += 1
+        return await loop.run_in_executor(self._executor, self._call, time.perf_counter(), func, args)
+
+    def stats(self):
+        waits, runs = list(self._waits), list(self._runs)
+        avg = lambda samples : sum(samples)/len(samples) if samples else 0.0
+
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": avg(waits),
+            "max_wait": max(waits, default=0.0),
+            "avg_run": avg(runs),
+            "max_run": max(runs, default=0.0),
+        }
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+#collects single calls for a few ms and hands them to func as one batch, func returns results in the same order
+class MicroBatcher():
+    def __init__(self, func, max_batch=16, max_delay=0.005, executor=None):
+        self.func = func
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.executor = executor #BoundedExecutor, runs func on the loop when None
+
+        self._pending = []
+        self._timer = None
+
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif not self._timer:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        self.batches += 1
+        self.items += len(items)
+
+        try:
+            results = await self.executor.run(self.func, items) if self.executor else self.func(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": self.items/self.batches if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
+
+#keeps only the latest pending update per key and paces them to `rate` per `per` seconds, intermediate ones are dropped
+#an update that makes several requests passes its cost, so the pacing counts requests and not updates
+class CoalescingScheduler():
+    def __init__(self, rate=5, per=5.0):
+        self.rate = rate
+        self.per = per
+
+        self._pending = {} #key -> (latest coroutine factory, cost)
+        self._workers = {}
+        self._sent = {} #key -> times of recent requests
+
+        self.submitted = 0
+        self.applied = 0
+        self.requests = 0
+        self.coalesced = 0
+
+    def submit(self, key, factory, cost=1):
+        self.submitted += 1
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = (factory, min(cost, self.rate))
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.get_running_loop().create_task(self._work(key))
+
+    def cancel(self, key):
+        #send history stays, discord still counts those requests against the key after this
+        if self._pending.pop(key, None):
+            self.coalesced += 1
+        if worker := self._workers.pop(key, None):
+            worker.cancel()
+        self._forget_expired()
+
+    def charge(self, key, cost=1):
+        #requests made outside the scheduler that share the keys budget
+        self._sent.setdefault(key, deque()).extend([time.monotonic()]*cost)
+        self.requests += cost
+
+    def _forget_expired(self):
+        cutoff = time.monotonic() - self.per
+        for key in [key for key, sent in self._sent.items() if key not in self._workers and (not sent or sent[-1] <= cutoff)]:
+            del self._sent[key]
+
+    async def _work(self, key):
+        sent = self._sent.setdefault(key, deque())
+        try:
+            while key in self._pending:
+                now = time.monotonic()
+                while sent and sent[0] + self.per <= now:
+                    sent.popleft()
+
+                cost = self._pending[key][1]
+                if len(sent) + cost > self.rate:
+                    #sleeps until enough of the window frees up, more updates can land and replace the pending one meanwhile
+                    await asyncio.sleep(sent[len(sent) + cost - self.rate - 1] + self.per - now)
+                    continue
+
+                factory, cost = self._pending.pop(key)
+                sent.extend([now]*cost)
+                try:
+                    await factory()
+                except Exception as e:
+                    print(f"Update for {key} failed: {repr(e)}")
+                else:
+                    self.applied += 1
+                    self.requests += cost
+        finally:
+            if self._workers.get(key) is asyncio.current_task():
+                del self._workers[key]
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "applied": self.applied,
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "pending": len(self._pending),
+        }
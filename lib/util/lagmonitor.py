@@ -0,0 +1,104 @@
+from collections import deque
+import heapq
+import itertools
+import threading
+import traceback
+import asyncio
+import time
+import sys
+from lib.util.metrics import metrics
+
+class Stall():
+    __slots__ = ('duration', 'started', 'stack')
+
+    def __init__(self, duration, started, stack):
+        self.duration = duration
+        self.started = started #wall clock, for matching against logs
+        self.stack = stack #formatted frames of whatever held the loop, None if it was over before the watchdog looked
+
+#a heartbeat task measures scheduling delay, a watchdog thread grabs the loop thread's stack while a beat is overdue
+class LagMonitor():
+    INTERVAL = 0.1 #seconds between heartbeats
+    THRESHOLD = 0.1 #loop blocked for longer than this counts as a stall
+    KEEP = 20 #worst and most recent stalls kept
+    STACK_DEPTH = 12 #innermost frames kept per stall
+
+    def __init__(self, loop, interval=INTERVAL, threshold=THRESHOLD, keep=KEEP):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.keep = keep
+
+        self.lag = deque(maxlen=1024)
+        self.recent = deque(maxlen=keep)
+        self._worst = [] #min heap of (duration, seq, Stall), smallest gets dropped first
+        self._seq = itertools.count()
+        self.stalls = 0
+
+        self._beat = 0
+        self._beat_at = None
+        self._captured = None #(beat, stack) the watchdog took during the current beat
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task:
+            return
+        self._stop.clear()
+        self._task = self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="lag-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        while 1:
+            self._beat += 1
+            self._beat_at = time.monotonic()
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag = self.loop.time() - start - self.interval
+
+            self.lag.append(lag)
+            metrics.observe("loop_lag", lag)
+            if lag >= self.threshold:
+                captured = self._captured
+                self._record(lag, captured[1] if captured and captured[0] == self._beat else None)
+
+    def _record(self, duration, stack):
+        stall = Stall(duration, time.time() - duration, stack)
+        self.stalls += 1
+        self.recent.append(stall)
+        heapq.heappush(self._worst, (duration, next(self._seq), stall))
+        if len(self._worst) > self.keep:
+            heapq.heappop(self._worst)
+        print(f"Event loop blocked for {duration*1000:.0f}ms" + (f" in {stack[-1].strip().splitlines()[0]}" if stack else ""))
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold/2):
+            beat, beat_at = self._beat, self._beat_at
+            if beat_at is None or self._loop_thread is None:
+                continue
+            captured = self._captured
+            if captured and captured[0] == beat:
+                continue #already have this stall's stack
+            if time.monotonic() - beat_at - self.interval < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._captured = (beat, traceback.format_stack(frame)[-LagMonitor.STACK_DEPTH:])
+
+    def worst(self):
+        return [stall for _, _, stall in sorted(self._worst, reverse=True)]
+
+    def percentiles(self, points=(50, 95, 99)):
+        if not self.lag:
+            return {}
+        ordered = sorted(self.lag)
+        return {p: ordered[min(len(ordered) - 1, int(len(ordered)*p/100))] for p in points}
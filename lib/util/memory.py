@@ -0,0 +1,138 @@
+from collections import deque
+import tracemalloc
+import asyncio
+import types
+import time
+import gc
+import sys
+
+#things that are shared or not owned by whatever is being measured
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CoroutineType, types.FrameType, asyncio.Future, asyncio.AbstractEventLoop)
+
+def _slots(cls):
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        yield from (slots,) if isinstance(slots, str) else slots
+
+#rough retained size of obj, stops at anything in exclude so shared objects like the bot arent counted
+#passing the same seen set across calls counts anything reachable from several objects only once
+def deep_sizeof(obj, exclude=(), max_depth=8, seen=None):
+    seen = set() if seen is None else seen
+    seen.update(id(o) for o in exclude)
+    size = 0
+    stack = [(obj, 0)]
+
+    while stack:
+        current, depth = stack.pop()
+        if id(current) in seen or isinstance(current, SKIP_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current, 0)
+
+        if depth >= max_depth:
+            continue
+
+        if isinstance(current, dict):
+            children = [*current.keys(), *current.values()]
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            children = current
+        else:
+            children = [getattr(current, slot, None) for slot in _slots(type(current))]
+            if hasattr(current, "__dict__"):
+                children.append(current.__dict__)
+
+        stack.extend((child, depth + 1) for child in children if child is not None)
+
+    return size
+
+#current resident set size in bytes, peak rss where /proc isnt around, None if neither is
+def rss():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak*1024
+
+#live instances of each class and their combined retained size, walks every gc tracked object so its for on demand use
+#yields to the loop every YIELD_EVERY objects, only gc.get_objects itself still blocks in one go
+#max_sized caps how many instances per class get deep walked, the rest are counted and their size extrapolated
+YIELD_EVERY = 10000
+MAX_SIZED = 2000
+
+async def instance_stats(classes, exclude=(), max_sized=MAX_SIZED):
+    found = {cls: [] for cls in classes}
+    for n, obj in enumerate(gc.get_objects()):
+        if n % YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+        cls = type(obj)
+        if cls in found:
+            found[cls].append(obj)
+        else:
+            for klass in classes: #subclasses, like the concrete adapters
+                if isinstance(obj, klass):
+                    found[klass].append(obj)
+                    break
+
+    stats = {}
+    for cls, objects in found.items():
+        seen = set()
+        size = 0
+        for n, obj in enumerate(objects[:max_sized]):
+            if n % 100 == 0:
+                await asyncio.sleep(0)
+            size += deep_sizeof(obj, exclude, seen=seen)
+        if len(objects) > max_sized:
+            size = size*len(objects)//max_sized
+        stats[cls.__name__] = (len(objects), size)
+    return stats
+
+#tracemalloc only while someone is looking, it slows every allocation down when on
+class MallocTracker():
+    FRAMES = 1 #traceback depth per allocation, more frames means more overhead
+    IGNORE = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+
+    def __init__(self):
+        self.baseline = None
+        self.started_at = None
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=FRAMES):
+        if not self.running:
+            tracemalloc.start(frames)
+            self.started_at = time.monotonic()
+        self.baseline = self._snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+        self.started_at = None
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(MallocTracker.IGNORE)
+
+    def snapshot(self):
+        #new baseline, later diffs are against this point
+        self.baseline = self._snapshot()
+
+    def diff(self, limit=10, key="lineno"):
+        current = self._snapshot()
+        return current.compare_to(self.baseline, key)[:limit]
+
+    def top(self, limit=10, key="lineno"):
+        return self._snapshot().statistics(key)[:limit]
+
+    def traced(self):
+        return tracemalloc.get_traced_memory() #(current, peak) bytes
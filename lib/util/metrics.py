@@ -0,0 +1,134 @@
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+import bisect
+import time
+
+#cumulative buckets for prometheus, percentiles come from a window of recent samples instead
+class Histogram():
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, window=1024, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1) #last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentiles(self, points=(50, 95, 99)):
+        if not self.recent:
+            return {}
+        ordered = sorted(self.recent)
+        return {p: ordered[min(len(ordered) - 1, int(len(ordered)*p/100))] for p in points}
+
+class Metrics():
+    GUILD_WINDOW = 64 #recent samples kept per guild, aggregate histograms keep Histogram's default
+    GUILD_SERIES = 50 #guilds exported with their own labels, caps scrape size and label cardinality
+
+    def __init__(self, prefix="melo"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = Counter()
+        self.guilds = defaultdict(dict) #guild id -> name -> Histogram
+        self.guild_counters = defaultdict(Counter)
+
+    def observe(self, name, seconds, guild_id=None):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(seconds)
+
+        if guild_id is not None:
+            histograms = self.guilds[guild_id]
+            if name not in histograms:
+                histograms[name] = Histogram(Metrics.GUILD_WINDOW)
+            histograms[name].observe(seconds)
+
+    def inc(self, name, guild_id=None, amount=1):
+        self.counters[name] += amount
+        if guild_id is not None:
+            self.guild_counters[guild_id][name] += amount
+
+    @contextmanager
+    def timer(self, name, guild_id=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, guild_id)
+
+    def percentiles(self, name, guild_id=None):
+        histogram = self.guilds.get(guild_id, {}).get(name) if guild_id is not None else self.histograms.get(name)
+        return histogram.percentiles() if histogram else {}
+
+    def drop_guild(self, guild_id):
+        self.guilds.pop(guild_id, None)
+        self.guild_counters.pop(guild_id, None)
+
+    def _exported_guilds(self):
+        #one series set per guild, so only the busiest GUILD_SERIES guilds get exported
+        activity = {guild_id: sum(histogram.count for histogram in histograms.values()) for guild_id, histograms in self.guilds.items()}
+        for guild_id, counters in self.guild_counters.items():
+            activity[guild_id] = activity.get(guild_id, 0) + sum(counters.values())
+        return sorted(activity, key=activity.get, reverse=True)[:Metrics.GUILD_SERIES]
+
+    def render(self):
+        #prometheus text format, aggregates as histograms and counters, per guild data in separate summary and counter families
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.count}")
+
+        for name, value in sorted(self.counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        guild_ids = self._exported_guilds()
+        for name in sorted(self.histograms):
+            metric = f"{self.prefix}_guild_{name}_seconds"
+            series = [(guild_id, self.guilds[guild_id][name]) for guild_id in guild_ids if name in self.guilds.get(guild_id, {})]
+            if not series:
+                continue
+            lines.append(f"# TYPE {metric} summary") #quantiles over the guilds recent window, not all time
+            for guild_id, histogram in series:
+                for point, value in histogram.percentiles().items():
+                    lines.append(f'{metric}{{guild="{guild_id}",quantile="{point/100}"}} {value}')
+                lines.append(f'{metric}_sum{{guild="{guild_id}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{guild="{guild_id}"}} {histogram.count}')
+
+        for name in sorted(self.counters):
+            metric = f"{self.prefix}_guild_{name}_total"
+            series = [(guild_id, self.guild_counters[guild_id][name]) for guild_id in guild_ids if name in self.guild_counters.get(guild_id, {})]
+            if not series:
+                continue
+            lines.append(f"# TYPE {metric} counter")
+            for guild_id, value in series:
+                lines.append(f'{metric}{{guild="{guild_id}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics() #shared by every cog and player context
+
+async def start_server(host, port, source=metrics):
+    from aiohttp import web #comes with disnake
+
+    async def handle(request):
+        return web.Response(text=source.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
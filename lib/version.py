@@ -0,0 +1 @@
+VERSION = "0.6.1" #kept free of imports, launcher.py reads it without loading the bot
@@ -1,9 +1,9 @@
 from pickle import TRUE
-from lib.bot import bot
+from lib.bot import Bot
+from lib.version import VERSION
 
-VERSION = "0.6.1"
-
-bot.run(VERSION, False)
+if __name__ == "__main__":
+    Bot().run(VERSION, False)
 
 #when soemone wants to talk directly to bot with nlp, make them talk in a thead
 #https://pythonrepo.com/repo/Pycord-Development-Pycord-Wavelink
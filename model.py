@@ -1,10 +1,12 @@
 import os
+import sys
+import json
+import threading
 import math
 import datetime
 
 from tqdm import tqdm
 
-import pandas as pd
 import numpy as np
 
 import tensorflow as tf
@@ -22,17 +24,26 @@ RANDOM_SEED = 42
 np.random.seed(RANDOM_SEED)
 tf.random.set_seed(RANDOM_SEED)
 
-train = pd.read_csv("train.csv")
-valid = pd.read_csv("valid.csv")
-test = pd.read_csv("test.csv")
-
-train = train.append(valid).reset_index(drop=True)
-
 bert_model_name="uncased_L-12_H-768_A-12"
 
 bert_ckpt_dir = os.path.join("model/", bert_model_name)
 bert_ckpt_file = os.path.join(bert_ckpt_dir, "bert_model.ckpt")
 bert_config_file = os.path.join(bert_ckpt_dir, "bert_config.json")
+vocab_file = os.path.join(bert_ckpt_dir, 'vocab.txt')
+
+weights_file = 'bert_weights.h5'
+serving_file = 'intent_serving.json' #everything intent_model needs at runtime, written by export_serving
+quantized_file = 'intent_model.tflite' #dynamic range int8 copy of the trained model, written by export_quantized, experimental
+
+def load_datasets():
+  import pandas as pd #only needed for training and exporting, serving never loads the csvs
+
+  train = pd.read_csv("train.csv")
+  valid = pd.read_csv("valid.csv")
+  test = pd.read_csv("test.csv")
+
+  train = train.append(valid).reset_index(drop=True)
+  return train, test
 
 
 
@@ -75,16 +86,15 @@ class IntentDetectionData:
       x.append(np.array(input_ids))
     return np.array(x)
 
-tokenizer = FullTokenizer(vocab_file=os.path.join(bert_ckpt_dir, 'vocab.txt'))
+tokenizer = FullTokenizer(vocab_file=vocab_file)
 
-def create_model(max_seq_len, bert_config_file , bert_ckpt_file):
+def create_model(max_seq_len, bert_config_file , bert_ckpt_file, classes, load_stock=True):
 
     with tf.io.gfile.GFile(bert_config_file, 'r') as reader:
         bc = StockBertConfig.from_json_string(reader.read())
         bert_params = map_stock_config_to_params(bc)
         bert_params.adapter_size = None
         bert = BertModelLayer.from_params(bert_params, name='bert')
-    classes = train.intent.unique().tolist()
 
 
     input_ids = keras.layers.Input(shape=(max_seq_len, ), dtype='int32', name='input_ids')
@@ -101,49 +111,124 @@ def create_model(max_seq_len, bert_config_file , bert_ckpt_file):
     model = keras.Model(inputs=input_ids, outputs=logits)
     model.build(input_shape=(None, max_seq_len))
 
-    load_stock_weights(bert, bert_ckpt_file)
+    if load_stock: #skipped when trained weights get loaded over it anyway
+        load_stock_weights(bert, bert_ckpt_file)
 
     return model
-class intent_model():
-    def __init__(self):
-        self.gen_model()
 
-    def gen_model(self):
-        classes = train.intent.unique().tolist()
+def export_serving(path=serving_file, weights=weights_file):
+    train, test = load_datasets()
+    classes = train.intent.unique().tolist()
+    data = IntentDetectionData(train, test, tokenizer, classes, max_seq_len=128)
 
-        data = IntentDetectionData(train, test, tokenizer, classes, max_seq_len=128)
-        model = create_model(data.max_seq_len, bert_config_file, bert_ckpt_file)
+    meta = {
+        "classes": classes,
+        "max_seq_len": data.max_seq_len,
+        "vocab_file": vocab_file,
+        "bert_config_file": bert_config_file,
+        "weights": weights,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
 
-        model.load_weights('bert_weights.h5') 
+    return meta
 
-        self.classes = classes
-        self.data = data
-        self.model = model
+def load_serving(path=serving_file):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    def intent(self, sentence):
-        classes = self.classes
-        data = self.data
-        sentences = [sentence]
+#unverified, the tflite converter hasnt been run against this model yet, the bert Lambda layer may need select tf ops to convert
+def export_quantized(path=quantized_file, serving_path=serving_file):
+    meta = load_serving(serving_path)
+    model = create_model(meta["max_seq_len"], meta["bert_config_file"], bert_ckpt_file, meta["classes"], load_stock=False)
+    model.load_weights(meta["weights"])
 
-        pred_tokens = map(tokenizer.tokenize, sentences)
-        pred_tokens = map(lambda tok: ["[CLS]"] + tok + ["[SEP]"], pred_tokens)
-        pred_token_ids = list(map(tokenizer.convert_tokens_to_ids, pred_tokens))
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT] #weights to int8, activations stay float
+    with open(path, "wb") as f:
+        f.write(converter.convert())
 
+    meta["quantized"] = path
+    with open(serving_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
 
-        pred_token_ids = map(lambda tids: tids +[0]*(data.max_seq_len-len(tids)),pred_token_ids)
-        pred_token_ids = np.array(list(pred_token_ids))
+    return meta
 
-        predictions = self.model.predict(pred_token_ids).argmax(axis=-1)
+class intent_model():
+    def __init__(self, serving_path=serving_file, quantized=False):
+        self.gen_model(serving_path, quantized)
+
+    def gen_model(self, serving_path=serving_file, quantized=False):
+        if os.path.exists(serving_path):
+            meta = load_serving(serving_path)
+        else:
+            print(f"{serving_path} not found, building it from the datasets...")
+            meta = export_serving(serving_path)
+
+        if quantized and not os.path.exists(meta.get("quantized") or quantized_file):
+            print(f"{quantized_file} not found, exporting it from {meta['weights']}...")
+            meta = export_quantized(quantized_file, serving_path)
+
+        self.classes = meta["classes"]
+        self.max_seq_len = meta["max_seq_len"]
+        self.tokenizer = tokenizer if meta["vocab_file"] == vocab_file else FullTokenizer(vocab_file=meta["vocab_file"])
+        self.model = None
+        self.interpreter = None
+
+        if quantized:
+            self.interpreter = tf.lite.Interpreter(model_path=meta.get("quantized") or quantized_file)
+            self._input = self.interpreter.get_input_details()[0]["index"]
+            self._output = self.interpreter.get_output_details()[0]["index"]
+            self._interpreter_lock = threading.Lock() #one interpreter, shared by the nlp pool threads
+            self._batch_size = None
+        else:
+            self.model = create_model(meta["max_seq_len"], meta["bert_config_file"], bert_ckpt_file, meta["classes"], load_stock=False)
+            self.model.load_weights(meta["weights"]) 
+
+    def _predict(self, token_ids):
+        if not self.interpreter:
+            return self.model.predict(token_ids, batch_size=len(token_ids))
+
+        with self._interpreter_lock:
+            if self._batch_size != len(token_ids):
+                self.interpreter.resize_tensor_input(self._input, token_ids.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(token_ids)
+
+            self.interpreter.set_tensor(self._input, token_ids)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+    def encode(self, sentences):
+        max_seq_len = self.max_seq_len
+        tokenizer = self.tokenizer
+        token_ids = np.zeros((len(sentences), max_seq_len), dtype=np.int32) #padded once for the whole batch
+
+        for row, sentence in enumerate(sentences):
+            ids = tokenizer.convert_tokens_to_ids(["[CLS]"] + tokenizer.tokenize(sentence) + ["[SEP]"])[:max_seq_len]
+            token_ids[row, :len(ids)] = ids
+
+        return token_ids
+
+    def intents(self, sentences):
+        predictions = self._predict(self.encode(sentences)).argmax(axis=-1)
+        return [self.classes[label] for label in predictions]
+
+    def intent(self, sentence):
+        return "text:", sentence, "\nintent:", self.intents([sentence])[0]
 
-        for text, label in zip(sentences, predictions):
-            return "text:", text, "\nintent:", classes[label]
+if __name__ == "__main__" and sys.argv[1:] == ["export"]:
+    print(export_serving())
+elif __name__ == "__main__" and sys.argv[1:] == ["quantize"]:
+    print(export_quantized())
 
 """          
+train, test = load_datasets()
 classes = train.intent.unique().tolist()
 
 data = IntentDetectionData(train, test, tokenizer, classes, max_seq_len=128)
 
-model = create_model(data.max_seq_len, bert_config_file, bert_ckpt_file)
+model = create_model(data.max_seq_len, bert_config_file, bert_ckpt_file, classes)
 
 model.compile(
   optimizer=keras.optimizers.Adam(1e-5),
@@ -163,5 +248,6 @@ history = model.fit(
   callbacks=[tensorboard_callback]
 )
 
-model.save_weights('bert_weights.h5')
+model.save_weights(weights_file)
+export_serving()
 """